@@ -1,5 +1,17 @@
+import sys
+
 from .attachment import Attachment  # noqa
+from .batch import BatchResult  # noqa
 from .bug import Bug, BugException, Comment  # noqa
+from .cache import FileCache, MemoryCache, ResponseCache  # noqa
+from .compact import CompactAttachment, CompactBug, CompactComment  # noqa
 from .bugsy import Bugsy  # noqa
 from .errors import *  # noqa
-from .search import Search  # noqa
+from .identity import IdentityMap  # noqa
+from .mirror import LocalSearch, Mirror  # noqa
+from .ratelimit import FileTokenBucket, TokenBucket  # noqa
+from .retry import RetryPolicy  # noqa
+from .search import Search, SearchCursor  # noqa
+
+if sys.version_info >= (3, 6):
+    from .aio import AsyncBugsy, AsyncSearch  # noqa
@@ -0,0 +1,405 @@
+import asyncio
+import json
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .attachment import Attachment
+from .batch import BatchResult
+from .bugsy import Bugsy, _bug_ids, _check_response
+from .errors import BugsyException, SearchException
+from .search import Search, _window_params
+
+
+class AsyncBugsy(object):
+    """
+        An asyncio counterpart of :class:`Bugsy` that talks to Bugzilla with
+        aiohttp, so waiting on Bugzilla never blocks the event loop and no
+        threads are used. aiohttp is an optional dependency, install it with
+        ``pip install bugsy[async]``.
+
+        At most ``max_concurrency`` requests are in flight at any one time
+        and failed requests are retried following the :class:`RetryPolicy`
+        of :attr:`bugsy`. Responses are never cached and the rate limiter of
+        :attr:`bugsy` isn't used, but writes still make the responses it
+        cached about the bugs written to stale.
+
+        The bugs, comments and attachments it returns belong to
+        :attr:`bugsy`, a blocking :class:`Bugsy` sharing its credentials.
+        Their own methods that talk to Bugzilla, like :meth:`Bug.update` or
+        reading :attr:`Attachment.data` before it was downloaded, block, so
+        use the awaitable methods here instead.
+
+        >>> async with AsyncBugsy(api_key='...') as bugzilla:
+        ...     bug = await bugzilla.get(123456)
+        ...     bugs = await asyncio.gather(*[bugzilla.get(i) for i in ids])
+    """
+
+    DEFAULT_CONCURRENCY = 100
+
+    def __init__(
+            self,
+            username=None,
+            password=None,
+            userid=None,
+            cookie=None,
+            api_key=None,
+            bugzilla_url='https://bugzilla.mozilla.org/rest',
+            max_concurrency=DEFAULT_CONCURRENCY,
+            timeout=None,
+            retry=True,
+            bugsy=None
+    ):
+        """
+            Initialises a new instance of AsyncBugsy
+
+            Takes the same authentication parameters as :class:`Bugsy`, and
+            authenticates in the same way, with blocking requests, while
+            being constructed.
+
+            :param max_concurrency: Maximum number of requests that will be
+                                    sent to Bugzilla at the same time.
+                                    Defaults to 100
+            :param timeout: Seconds to wait for the server, either a number or
+                            a (connect, read) tuple. Defaults to None, which
+                            waits forever
+            :param retry: A :class:`RetryPolicy`, see :class:`Bugsy`.
+                          Defaults to True
+            :param bugsy: An existing :class:`Bugsy` instance whose url,
+                          credentials, timeout and retry policy are used
+                          instead of the arguments above. Defaults to None
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncBugsy needs aiohttp, install it with "
+                              "pip install bugsy[async]")
+        self._own_bugsy = bugsy is None
+        if bugsy is None:
+            bugsy = Bugsy(username=username, password=password,
+                          userid=userid, cookie=cookie, api_key=api_key,
+                          bugzilla_url=bugzilla_url, timeout=timeout,
+                          retry=retry)
+        self.bugsy = bugsy
+        self.max_concurrency = max_concurrency
+        self._session = None
+
+    @property
+    def authenticated(self):
+        """
+            True if this instance is authenticated against the server.
+        """
+        return self.bugsy.authenticated
+
+    @property
+    def search_for(self):
+        return AsyncSearch(self)
+
+    async def get(self, bug_number, include_fields=None):
+        """
+            Get a bug from Bugzilla. See :meth:`Bugsy.get`
+
+            >>> bug = await bugzilla.get(123456)
+        """
+        fields = include_fields if include_fields else self.bugsy.DEFAULT_SEARCH
+        result = await self.request(
+            'bug/%s' % bug_number,
+            params={'include_fields': self.bugsy._include_fields(fields)})
+        return self.bugsy._make_bug(result['bugs'][0])
+
+    async def put(self, bug, refetch=True, include_fields=None):
+        """
+            Create or update a bug on Bugzilla. See :meth:`Bugsy.put`
+
+            >>> await bugzilla.put(bug)
+            >>> await bugzilla.put(bug, refetch=False)
+        """
+        self.bugsy._check_put(bug)
+        if not bug.id:
+            result = await self.request('bug', 'POST', json=bug.to_dict())
+            self.bugsy._created(bug, result)
+            return
+        result = await self.request('bug/%s' % bug.id, 'PUT',
+                                    json=bug.diff())
+        self.bugsy._updated(bug, result)
+        if not refetch:
+            return bug
+        return await self.get(bug.id, include_fields)
+
+    async def get_comments(self, bug_ids, new_since=None, chunk_size=None):
+        """
+            Get the comments for many bugs, asking about a chunk of bugs in
+            each request and sending the requests at the same time. See
+            :meth:`Bugsy.get_comments`
+
+            >>> comments = await bugzilla.get_comments([123456, 654321])
+        """
+        pending = self.bugsy._comment_requests(bug_ids, new_since, chunk_size)
+        responses = await asyncio.gather(
+            *[self._request_or_error(path, params=params)
+              for _, path, params in pending])
+        result = BatchResult()
+        for (chunk, _, _), res in zip(pending, responses):
+            self.bugsy._add_comments(result, chunk, res)
+        return result
+
+    async def comments_of(self, bug, new_since=None):
+        """
+            Obtain comments for a bug. See :meth:`Bug.get_comments`
+
+            >>> comments = await bugzilla.comments_of(bug)
+        """
+        comments = await self.get_comments([bug.id], new_since=new_since)
+        for error in comments.errors.values():
+            raise error
+        return comments[bug.id]
+
+    async def get_attachments(self, bug, include_data=False):
+        """
+            Obtain attachments for a bug. See :meth:`Bug.get_attachments`.
+            Use :meth:`attachment_data` to download the content of the ones
+            fetched without it.
+
+            >>> attachments = await bugzilla.get_attachments(bug)
+        """
+        params = None if include_data else {'exclude_fields': 'data'}
+        res = await self.request('bug/%s/attachment' % bug.id, params=params)
+        return [Attachment(bugsy=self.bugsy, **attachment)
+                for attachment in res['bugs'][str(bug.id)]]
+
+    async def attachment_data(self, attachment):
+        """
+            Download the content of an attachment if we don't have it yet
+            and return it, so that :attr:`Attachment.data` can then be read
+            without blocking.
+
+            >>> data = await bugzilla.attachment_data(attachment)
+        """
+        if 'data' in attachment._attachment:
+            return attachment._attachment['data']
+        res = await self.request('bug/attachment/%s' % attachment.id,
+                                 params={'include_fields': 'data'})
+        return attachment._store_data(res)
+
+    async def request(self, path, method='GET', headers=None, params=None,
+                      **kwargs):
+        """
+            Perform a HTTP request. Like :meth:`Bugsy.request`, with the
+            remaining arguments, like ``json``, passed on to aiohttp.
+        """
+        session = self._client()
+        # Authentication was done by self.bugsy, send what it sends
+        all_headers = dict((key, value)
+                           for key, value in self.bugsy.session.headers.items()
+                           if key.startswith('X-Bugzilla'))
+        all_headers.update(headers or {})
+        all_headers['User-Agent'] = 'Bugsy'
+        all_params = dict(self.bugsy.session.params)
+        all_params.update(params or {})
+        url = '%s/%s' % (self.bugsy.bugzilla_url, path)
+
+        if method.upper() == 'GET' or self.bugsy.cache is None:
+            return await self._send(session, method, url, all_headers,
+                                    all_params, kwargs)
+        try:
+            return await self._send(session, method, url, all_headers,
+                                    all_params, kwargs)
+        finally:
+            # The bugs may have changed, don't let self.bugsy serve them
+            # from its cache
+            self.bugsy._invalidate(_bug_ids(path, all_params,
+                                            kwargs.get('json')))
+
+    async def _send(self, session, method, url, headers, params, kwargs):
+        retry = self.bugsy.retry
+        if retry is not None:
+            retry._count_request()
+        attempt = 0
+        while True:
+            try:
+                async with session.request(method, url, headers=headers,
+                                           params=_query(params),
+                                           **kwargs) as response:
+                    text = await response.text()
+                    if retry is None or \
+                            response.status not in retry.retry_statuses or \
+                            not retry.should_retry(method, attempt,
+                                                   response.status):
+                        return _check_response(response.status,
+                                               lambda: text,
+                                               lambda: json.loads(text))
+                    delay = retry.backoff(attempt, response)
+            except asyncio.TimeoutError:
+                if retry is None or \
+                        not retry.should_retry(method, attempt, 'timeout'):
+                    raise
+                delay = retry.backoff(attempt)
+            except aiohttp.ClientConnectionError:
+                if retry is None or \
+                        not retry.should_retry(method, attempt, 'connection'):
+                    raise
+                delay = retry.backoff(attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        """
+            Close the connections to Bugzilla, and the :class:`Bugsy`
+            instance unless it was passed in.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._own_bugsy:
+            self.bugsy.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def _client(self):
+        # The session is created on first use so that it belongs to the
+        # running event loop rather than whichever loop existed at __init__.
+        if self._session is None:
+            timeout = self.bugsy.timeout
+            if isinstance(timeout, tuple):
+                connect, read = timeout
+            else:
+                connect = read = timeout
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect,
+                                              sock_read=read))
+        return self._session
+
+    async def _request_or_error(self, path, **kwargs):
+        # Like request() but returns the BugsyException instead of raising
+        # it, for batches where one failure shouldn't stop the rest
+        try:
+            return await self.request(path, **kwargs)
+        except BugsyException as e:
+            return e
+
+
+class AsyncSearch(Search):
+    """
+        A :class:`Search` whose methods that talk to Bugzilla, search(),
+        count(), ids() and sharded_search(), return awaitables and whose
+        iter_search() is an asynchronous iterator. The methods that build up
+        the search are the same as on :class:`Search`.
+
+        >>> bugs = await bugzilla.search_for\\
+        ...                      .keywords("checkin-needed")\\
+        ...                      .search()
+        >>> async for bug in bugzilla.search_for.product("Firefox")\\
+        ...                                     .iter_search():
+        ...     print(bug.summary)
+    """
+    def __init__(self, async_bugsy):
+        super(AsyncSearch, self).__init__(async_bugsy.bugsy)
+        self._async_bugsy = async_bugsy
+
+    async def search(self):
+        params = self._search_params()
+        self._faults = []
+        if self._bug_numbers:
+            return await self._bug_number_search(params,
+                                                 self._bug_number_chunk_size)
+        results = await self._arequest(params)
+        return [self._make_bug(bug) for bug in results['bugs']]
+
+    async def iter_search(self, page_size=None):
+        page_size = page_size or self.PAGE_SIZE
+        if page_size < 1:
+            raise SearchException("page_size should be a positive number")
+
+        params = self._search_params()
+        self._faults = []
+        if self._bug_numbers:
+            for chunk, chunk_params in self._bug_number_chunks(params,
+                                                               page_size):
+                result = await self._async_bugsy._request_or_error(
+                    'bug', params=chunk_params)
+                for bug in self._chunk_bugs(chunk, result):
+                    yield bug
+            return
+
+        # Sort by id so that pages don't overlap or skip bugs
+        params['order'] = self._order
+        offset = 0
+        while True:
+            params['limit'] = page_size
+            params['offset'] = offset
+            results = await self._arequest(params)
+            for bug in results['bugs']:
+                yield self._make_bug(bug)
+            if len(results['bugs']) < page_size:
+                break
+            offset += page_size
+
+    async def count(self):
+        if self._bug_numbers:
+            return len(await self.ids())
+        params = self._search_params()
+        params.pop('include_fields', None)
+        params.pop('exclude_fields', None)
+        params['count_only'] = 1
+        return int((await self._arequest(params))['bug_count'])
+
+    async def ids(self):
+        params = self._search_params()
+        params['include_fields'] = 'id'
+        params.pop('exclude_fields', None)
+        self._faults = []
+        if self._bug_numbers:
+            return await self._bug_number_search(
+                params, self._bug_number_chunk_size,
+                lambda bug: int(bug['id']))
+        return [int(bug['id']) for bug in (await self._arequest(params))['bugs']]
+
+    async def sharded_search(self, shards=4, limit=None):
+        if self._bug_numbers:
+            return await self.search()
+        limit = limit or self.SHARD_LIMIT
+        windows = self._shard_windows(shards)
+
+        params = self._search_params()
+        self._faults = []
+        found = {}
+        while windows:
+            results = await asyncio.gather(
+                *[self._arequest(_window_params(params, window, limit))
+                  for window in windows])
+            windows = self._windows_cut_short(
+                zip(windows, [result['bugs'] for result in results]),
+                found, limit)
+        return [self._make_bug(found[bug_id]) for bug_id in sorted(found)]
+
+    async def _bug_number_search(self, params, chunk_size, make_bug=None):
+        # Every chunk of bug numbers is asked for at the same time
+        chunks = list(self._bug_number_chunks(params, chunk_size))
+        results = await asyncio.gather(
+            *[self._async_bugsy._request_or_error('bug', params=chunk_params)
+              for _, chunk_params in chunks])
+        bugs = []
+        for (chunk, _), result in zip(chunks, results):
+            bugs.extend(self._chunk_bugs(chunk, result, make_bug))
+        return bugs
+
+    async def _arequest(self, params):
+        try:
+            return await self._async_bugsy.request('bug', params=params)
+        except BugsyException as e:
+            raise SearchException(e.msg, e.code)
+
+
+def _query(params):
+    # aiohttp only takes strings, lists become a parameter per item like
+    # they do with requests
+    query = []
+    for key, value in params.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        query.extend((key, str(item)) for item in values if item is not None)
+    return query
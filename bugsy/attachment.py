@@ -1,11 +1,18 @@
 import base64
-import binascii
 import copy
-from datetime import datetime as dt
+import json
+import mmap
+import os
+import re
 
 import six
 
-from .errors import AttachmentException
+from .dates import str2datetime
+from .errors import AttachmentException, BugsyException
+
+_WHITESPACE = re.compile(b'\\s+')
+_BASE64 = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+_TEXT_WHITESPACE = re.compile(r'\s+')
 
 
 class Attachment(object):
@@ -21,6 +28,7 @@ class Attachment(object):
     """
     CREATE_REQUIRED = ['data', 'file_name', 'summary', 'content_type']
     CREATE_FIELDS = CREATE_REQUIRED + ['comment', 'flags', 'is_markdown', 'is_patch', 'is_private']
+    TIME_FIELDS = ['creation_time', 'last_change_time']
     UPDATE_FIELDS = ['bug_flags', 'comment', 'content_type', 'file_name', 'flags', 'is_obsolete',
                      'is_patch', 'is_private', 'summary']
 
@@ -30,32 +38,30 @@ class Attachment(object):
         self._copy = copy.deepcopy(self._attachment)
 
     def __getattr__(self, attr):
+        if attr == 'data' and attr not in self._attachment:
+            return self._fetch_data()
         if attr not in self._attachment:
             return None
 
-        return self._attachment[attr]
+        value = self._attachment[attr]
+        if attr in self.TIME_FIELDS and isinstance(value, six.string_types):
+            # Times are only parsed the first time they are asked for
+            value = str2datetime(value)
+            self._attachment[attr] = value
+        return value
 
     def __setattr__(self, attr, value):
         if attr.startswith('_'):
             if attr == '_bugsy':
                 object.__setattr__(self, attr, value)
             elif attr == '_attachment':
-                clone = copy.deepcopy(value)
-                time_fields = {'creation_time', 'last_change_time'}
-                for time_field in list(time_fields & set(clone.keys())):
-                    clone[time_field] = dt.strptime(clone[time_field], '%Y-%m-%dT%H:%M:%SZ')
-                object.__setattr__(self, attr, clone)
+                object.__setattr__(self, attr, copy.deepcopy(value))
             elif attr == '_copy':
                 object.__setattr__(self, attr, value)
         else:
             if attr == 'data':
-                # Attempt to decode data to ensure it's valid
-                try:
-                    if hasattr(base64, 'decodebytes'):
-                        base64.decodebytes(value.encode('utf-8'))
-                    else:
-                        base64.decodestring(value)
-                except binascii.Error:
+                # Check the data looks like base64 without decoding it all
+                if not _is_base64(value):
                     raise AttachmentException('The data field value must be in base64 format')
             elif attr in ['comment', 'content_type', 'file_name', 'summary']:
                 if not isinstance(value, six.string_types):
@@ -70,10 +76,79 @@ class Attachment(object):
 
             self._attachment[attr] = copy.copy(value)
 
+    def save_to(self, path_or_fileobj):
+        """
+            Write the decoded content of this attachment to a file, either a
+            path or an open binary file object. The content is downloaded
+            first if we don't have it yet.
+
+            >>> attachments = bug.get_attachments()
+            >>> attachments[0].save_to('/tmp/crash.dmp')
+        """
+        if hasattr(path_or_fileobj, 'write'):
+            for chunk in self.iter_bytes():
+                path_or_fileobj.write(chunk)
+        else:
+            with open(path_or_fileobj, 'wb') as f:
+                for chunk in self.iter_bytes():
+                    f.write(chunk)
+
+    def iter_bytes(self, chunk_size=64 * 1024):
+        """
+            Yield the decoded content of this attachment a chunk at a time.
+            If we don't have the content yet it is streamed from Bugzilla and
+            decoded as it arrives, so memory use stays proportional to
+            chunk_size rather than to the size of the attachment.
+
+            :param chunk_size: Bytes of the response read at a time. Defaults
+                               to 64KB
+
+            >>> with open('/tmp/crash.dmp', 'wb') as f:
+            ...     for chunk in attachment.iter_bytes():
+            ...         f.write(chunk)
+        """
+        if 'data' in self._attachment:
+            data = self._attachment['data']
+            if not isinstance(data, bytes):
+                data = data.encode('ascii')
+            pieces = (data[i:i + chunk_size]
+                      for i in range(0, len(data), chunk_size))
+            for chunk in _b64decode_pieces(pieces):
+                yield chunk
+            return
+
+        if not self.id or self._bugsy is None:
+            raise AttachmentException('Cannot download an attachment without an id')
+        response = self._bugsy.stream('bug/attachment/%s' % self.id,
+                                      params={'include_fields': 'data'})
+        try:
+            pieces = _json_string_pieces(response.iter_content(chunk_size), b'data')
+            for chunk in _b64decode_pieces(pieces):
+                yield chunk
+        finally:
+            response.close()
+
+    def _fetch_data(self):
+        # Attachments are fetched without their content by default, it is
+        # downloaded the first time it is used.
+        if not self.id or self._bugsy is None:
+            return None
+        res = self._bugsy.request('bug/attachment/%s' % self.id,
+                                  params={'include_fields': 'data'})
+        return self._store_data(res)
+
+    def _store_data(self, res):
+        data = res['attachments'][str(self.id)]['data']
+        self._attachment['data'] = data
+        self._copy['data'] = data
+        return data
+
     def to_dict(self):
         """
             Return the raw dict that is used inside this object
         """
+        for field in self.TIME_FIELDS:
+            getattr(self, field)
         return self._attachment
 
     def update(self):
@@ -90,3 +165,155 @@ class Attachment(object):
 
         self._attachment = res['attachments'][0]
         self._copy = copy.deepcopy(self._attachment)
+
+
+def _is_base64(value):
+    if not isinstance(value, six.string_types):
+        return False
+    if _TEXT_WHITESPACE.search(value):
+        value = _TEXT_WHITESPACE.sub('', value)
+    return len(value) % 4 == 0 and _BASE64.match(value) is not None
+
+
+def _json_with_data(fields, source, chunk_size=3 * 64 * 1024):
+    """
+        Yield a JSON object made of ``fields`` plus a ``data`` field holding
+        the base64 encoded content of ``source``, a path or a binary file
+        object. The content is read and encoded a chunk at a time, memory
+        mapping files where possible.
+    """
+    # Encoding a multiple of 3 bytes at a time means no padding until the end
+    chunk_size = max(3, chunk_size - chunk_size % 3)
+    yield _json_head(fields)
+    if hasattr(source, 'read'):
+        for block in iter(lambda: source.read(chunk_size), b''):
+            yield base64.b64encode(block)
+    else:
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    for start in range(0, len(view), chunk_size):
+                        yield base64.b64encode(view[start:start + chunk_size])
+                finally:
+                    view.close()
+    yield b'"}'
+
+
+def _sized_json_with_data(fields, source, chunk_size=3 * 64 * 1024):
+    """
+        Like _json_with_data() for a path or a seekable file object, but the
+        length of the body is known up front so requests sends it with a
+        Content-Length header. Chunked bodies look empty to Bugzilla
+        deployments that read the request body the CGI way.
+    """
+    if hasattr(source, 'read'):
+        start = source.tell()
+        source.seek(0, os.SEEK_END)
+        size = source.tell() - start
+        source.seek(start)
+    else:
+        size = os.path.getsize(source)
+    length = len(_json_head(fields)) + 4 * ((size + 2) // 3) + len(b'"}')
+    return _SizedBody(_json_with_data(fields, source, chunk_size), length)
+
+
+def _json_head(fields):
+    # Everything in front of the base64 content
+    head = json.dumps(fields)
+    return (head[:-1] + (', ' if fields else '') + '"data": "').encode('utf-8')
+
+
+class _SizedBody(object):
+    """
+        A request body made of an iterator of byte strings with a known
+        total length. It can be read like a file or iterated over.
+    """
+
+    def __init__(self, chunks, length):
+        self._chunks = iter(chunks)
+        self._length = length
+        self._buf = b''
+        self._pos = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        if self._pos < len(self._buf):
+            yield self._buf[self._pos:]
+        self._buf, self._pos = b'', 0
+        for chunk in self._chunks:
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(self)
+        while self._pos >= len(self._buf):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._buf, self._pos = chunk, 0
+        result = self._buf[self._pos:self._pos + size]
+        self._pos += len(result)
+        return result
+
+
+def _json_string_pieces(chunks, key):
+    """
+        Yield the value of the string field ``key`` from a JSON document that
+        arrives in chunks, without holding the whole document in memory.
+        Only the escapes that can appear in base64 content are handled.
+    """
+    chunks = iter(chunks)
+    start = re.compile(b'"' + key + b'"\\s*:\\s*"')
+    buf = b''
+    for chunk in chunks:
+        buf += chunk
+        match = start.search(buf)
+        if match:
+            pending = buf[match.end():]
+            break
+    else:
+        # No such field, most likely Bugzilla sent back an error instead
+        try:
+            result = json.loads(buf.decode('utf-8'))
+        except ValueError:
+            result = None
+        if isinstance(result, dict) and result.get('error'):
+            raise BugsyException(result.get('message'), result.get('code'))
+        raise AttachmentException('No data was returned for the attachment')
+
+    while True:
+        end = pending.find(b'"')
+        if end != -1:
+            yield _unescape(pending[:end])
+            return
+        # An escape sequence may be split over two chunks
+        keep = b''
+        if pending.endswith(b'\\'):
+            pending, keep = pending[:-1], b'\\'
+        yield _unescape(pending)
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise AttachmentException('The attachment data was cut short')
+        pending = keep + chunk
+
+
+def _unescape(piece):
+    return piece.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'')
+
+
+def _b64decode_pieces(pieces):
+    """
+        Decode base64 text that arrives in pieces of any length.
+    """
+    buf = b''
+    for piece in pieces:
+        buf += _WHITESPACE.sub(b'', piece)
+        usable = len(buf) - len(buf) % 4
+        if usable:
+            yield base64.b64decode(buf[:usable])
+            buf = buf[usable:]
+    if buf:
+        raise AttachmentException('The data field value must be in base64 format')
@@ -0,0 +1,18 @@
+from collections import OrderedDict
+
+
+class BatchResult(OrderedDict):
+    """
+        The outcome of working on many bugs at once. Successful results are
+        stored against the key they were asked for, in the order they were
+        asked for, while anything that failed is kept in :attr:`errors`
+        instead of being raised part way through.
+
+        >>> result = bugzilla.get_many([123456, 654321])
+        >>> result[123456].summary
+        >>> result.errors
+        {654321: BugsyException(...)}
+    """
+    def __init__(self, *args, **kwargs):
+        super(BatchResult, self).__init__(*args, **kwargs)
+        self.errors = OrderedDict()
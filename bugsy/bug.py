@@ -1,7 +1,12 @@
 import copy
 import datetime
+import functools
+import os
 
-from .attachment import Attachment
+import six
+
+from .attachment import Attachment, _json_with_data, _sized_json_with_data
+from .dates import datetime2str, str2datetime
 from .errors import BugException
 
 VALID_STATUS = ["ASSIGNED", "NEW", "REOPENED", "RESOLVED", "UNCONFIRMED", "VERIFIED"]
@@ -11,12 +16,10 @@ ARRAY_TYPES = ["blocks", "cc", "cc_detail", "depends_on",
                "flags", "groups", "keywords", "see_also"]
 
 
-def str2datetime(s):
-    return datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%SZ')
-
-
 def unpack(src):
-    result = copy.deepcopy(src)
+    # Only the top level dict is copied, nested values are shared with src
+    # and must never be modified in place. Bug copies them on first access.
+    result = dict(src)
     if 'cc_detail' in result:
         result['cc'] = [item['email'] for item in result['cc_detail']]
         del result['cc_detail']
@@ -27,12 +30,58 @@ def unpack(src):
     return result
 
 
+def _fetched_fields(data):
+    # The fields Bugzilla sent, nothing has been fetched for a new bug
+    if not data.get('id'):
+        return set()
+    fields = set(data)
+    if 'cc_detail' in fields:
+        fields.discard('cc_detail')
+        fields.add('cc')
+    return fields
+
+
+class ObservedList(list):
+    """
+        A list that calls ``on_change`` before it is changed in place, so
+        a :class:`Bug` knows which of its list fields diff() has to look
+        at. Copies and pickles of it are plain lists.
+    """
+
+    def __init__(self, iterable, on_change):
+        super(ObservedList, self).__init__(iterable)
+        self._on_change = on_change
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self), memo)
+
+
+def _observed(name):
+    method = getattr(list, name)
+
+    def changed(self, *args, **kwargs):
+        self._on_change()
+        return method(self, *args, **kwargs)
+    changed.__name__ = name
+    return changed
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__',
+              '__setslice__', '__delslice__', 'append', 'extend', 'insert',
+              'remove', 'pop', 'clear', 'sort', 'reverse'):
+    if hasattr(list, _name):
+        setattr(ObservedList, _name, _observed(_name))
+
+
 class Bug(object):
     """This represents a Bugzilla Bug"""
 
     def __init__(self, bugsy=None, **kwargs):
         """
-            Defaults are set if there are no kwargs passed in. To pass in
+            Defaults are set for new bugs, ones without an id. To pass in
             a dict create the Bug object like the following
 
             :param bugsy: Bugsy instance to use to connect to Bugzilla.
@@ -40,29 +89,59 @@ class Bug(object):
             >>> bug = Bug(**myDict)
         """
         self._bugsy = bugsy
-        self._bug = dict(**kwargs)
-        self._copy = dict(**kwargs)
-        self._bug['op_sys'] = kwargs.get('op_sys', 'All')
-        self._bug['product'] = kwargs.get('product', 'core')
-        self._bug['component'] = kwargs.get('component', 'general')
-        self._bug['platform'] = kwargs.get('platform', 'All')
-        self._bug['version'] = kwargs.get('version', 'unspecified')
+        # _copy is the snapshot diff() compares against. _bug starts out
+        # sharing its values and a value is only copied into _bug when it
+        # could be changed, see __getattr__. _dirty holds the fields that
+        # may differ from _copy, the only ones diff() looks at.
+        self._copy = kwargs
+        object.__setattr__(self, '_bug', dict(self._copy))
+        object.__setattr__(self, '_owned', set())
+        object.__setattr__(self, '_dirty', set())
+        object.__setattr__(self, '_fetched', _fetched_fields(kwargs))
+        self._comments = None
+        self._comments_since = None
+        # A bug from Bugzilla that lacks a field just didn't ask for it
+        if not kwargs.get('id'):
+            self._bug['op_sys'] = kwargs.get('op_sys', 'All')
+            self._bug['product'] = kwargs.get('product', 'core')
+            self._bug['component'] = kwargs.get('component', 'general')
+            self._bug['platform'] = kwargs.get('platform', 'All')
+            self._bug['version'] = kwargs.get('version', 'unspecified')
+        self._dirty.update(key for key in self._bug if key not in self._copy)
 
     def __getattr__(self, attr):
         if attr not in self._bug:
             return None
 
-        return self._bug[attr]
+        value = self._bug[attr]
+        if attr in self._owned:
+            return value
+        if isinstance(value, list) and attr in ARRAY_TYPES and attr != 'flags':
+            # Lists of plain values report when they are changed
+            value = ObservedList(value, functools.partial(self._dirty.add, attr))
+            self._bug[attr] = value
+            self._owned.add(attr)
+        elif isinstance(value, (list, dict)):
+            # Anything else could be changed without us knowing
+            value = self._own(attr)
+            self._dirty.add(attr)
+        return value
 
     def __setattr__(self, attr, value):
-        if attr == '_bug' or attr == '_copy':
+        if attr == '_bug':
+            object.__setattr__(self, attr, unpack(value))
+            object.__setattr__(self, '_owned', set())
+            object.__setattr__(self, '_dirty', set())
+            object.__setattr__(self, '_fetched', _fetched_fields(value))
+        elif attr == '_copy':
             object.__setattr__(self, attr, unpack(value))
-        elif attr == '_bugsy':
+        elif attr in ('_bugsy', '_comments', '_comments_since'):
             object.__setattr__(self, attr, value)
         elif attr == 'status':
             if self.id:
                 if value in VALID_STATUS:
                     self._bug['status'] = value
+                    self._dirty.add('status')
                 else:
                     raise BugException("Invalid status type was used")
             else:
@@ -71,17 +150,50 @@ class Bug(object):
         elif attr == 'resolution':
             if value in VALID_RESOLUTION:
                 self._bug['resolution'] = value
+                self._dirty.add('resolution')
             else:
                 raise BugException("Invalid resolution type was used")
         elif attr in ARRAY_TYPES and not isinstance(value, list):
             raise BugException("Cannot set value to non-list type")
         else:
             self._bug[attr] = copy.copy(value)
+            self._owned.add(attr)
+            self._dirty.add(attr)
+
+    def _own(self, attr):
+        # Copy a value shared with _copy so it can be changed without
+        # changing the snapshot diff() compares against.
+        value = copy.deepcopy(self._bug[attr])
+        self._bug[attr] = value
+        self._owned.add(attr)
+        return value
+
+    def was_fetched(self, field):
+        """
+            Whether Bugzilla sent this field for the bug. Fields that weren't
+            asked for, for example because of :meth:`Search.only_fields`,
+            read as None just like fields that are empty, this tells them
+            apart. List fields like ``cc`` or ``keywords`` are the exception,
+            they always read as a list so they can be appended to, which is
+            empty when they weren't fetched.
+
+            >>> bug = bugzilla.search_for.only_fields("summary").search()[0]
+            >>> bug.assigned_to, bug.was_fetched("assigned_to")
+            (None, False)
+            >>> bug.keywords, bug.was_fetched("keywords")
+            ([], False)
+        """
+        return field in self._fetched
 
     def to_dict(self):
         """
             Return the raw dict that is used inside this object
         """
+        for attr, value in self._bug.items():
+            if isinstance(value, (list, dict)) and attr not in self._owned:
+                self._own(attr)
+        # The dict can be changed behind our back from now on
+        self._dirty.update(self._bug)
         return self._bug
 
     def update(self):
@@ -94,26 +206,119 @@ class Bug(object):
             >>> bug.update()
             >>> bug.status
             'FIXED'
+
+            If the Bugsy instance has an :class:`IdentityMap` the latest data
+            is merged into this object instead of replacing it.
         """
         if 'id' in self._bug:
-            result = self._bugsy.request('bug/%s' % self._bug['id'])
-            self._bug = dict(**result['bugs'][0])
-            self._copy = dict(**result['bugs'][0])
+            result = self._bugsy.request('bug/%s' % self._bug['id'],
+                                         fresh=True)
+            if getattr(self._bugsy, 'identity_map', None) is not None:
+                self._merge(result['bugs'][0])
+            else:
+                self._bug = dict(**result['bugs'][0])
+                self._copy = dict(**result['bugs'][0])
         else:
             raise BugException("Unable to update bug that isn't in Bugzilla")
 
-    def get_comments(self):
+    def _merge(self, data):
+        """
+            Bring this bug up to date with data fetched from Bugzilla. The
+            bug is only rebuilt from scratch if its ``last_change_time`` has
+            moved forward. Otherwise fields we didn't know about are added
+            and, unless the data is older than what we have, fields that
+            haven't been modified locally are refreshed.
+        """
+        new_time = data.get('last_change_time')
+        old_time = self._copy.get('last_change_time')
+        if new_time and old_time and new_time > old_time:
+            self._bug = data
+            self._copy = data
+            return
+
+        older = new_time and old_time and new_time < old_time
+        for key, value in data.items():
+            if key == 'cc_detail':
+                key, value = 'cc', [item['email'] for item in value]
+            if key in ARRAY_TYPES and not value:
+                value = []
+            if key not in self._copy or \
+                    (not older and self._bug.get(key) == self._copy[key]):
+                self._copy[key] = copy.deepcopy(value)
+                self._bug[key] = copy.deepcopy(value)
+                self._owned.discard(key)
+                self._dirty.discard(key)
+                self._fetched.add(key)
+
+    def _apply_changes(self, result):
+        """
+            Record that Bugzilla has accepted the changes made to this bug,
+            using an entry of the ``bugs`` list a PUT returns, so that diff()
+            is empty again without fetching the bug.
+        """
+        for key, change in result.get('changes', {}).items():
+            # Bugzilla reports every change as a string, only trust it for
+            # fields we already hold as strings.
+            if key not in ARRAY_TYPES and \
+                    isinstance(self._bug.get(key), six.string_types):
+                self._bug[key] = change.get('added')
+        if 'last_change_time' in result:
+            self._bug['last_change_time'] = result['last_change_time']
+        self._bug.pop('comment', None)
+        # _bug is already unpacked, unpacking it again would reset cc
+        object.__setattr__(self, '_copy', copy.deepcopy(self._bug))
+        self._dirty.clear()
+
+    def get_comments(self, new_since=None):
         """
             Obtain comments for this bug.
 
+            :param new_since: Only return comments made after this datetime.
+                              Defaults to None
+
             Returns a list of Comment instances.
         """
         bug = str(self._bug['id'])
-        res = self._bugsy.request('bug/%s/comment' % bug)
+        params = None
+        if new_since:
+            params = {'new_since': datetime2str(new_since)}
+        res = self._bugsy.request('bug/%s/comment' % bug, params=params)
 
         return [Comment(bugsy=self._bugsy, **comments) for comments
                 in res['bugs'][bug]['comments']]
 
+    def sync_comments(self):
+        """
+            Keep a local list of the comments on this bug up to date. The
+            first call gets every comment, later calls only ask Bugzilla for
+            comments made since the newest one we have and add them to the
+            list. Bugzilla only returns comments strictly newer than
+            ``new_since``, so we ask from a second earlier to catch comments
+            made in the same second and drop the ones we already have.
+
+            Returns the list of Comment instances, oldest first.
+
+            >>> comments = bug.sync_comments()
+            >>> # some time later
+            >>> comments = bug.sync_comments()
+        """
+        if self._comments is None:
+            new = self.get_comments()
+            self._comments = []
+        else:
+            new = self.get_comments(new_since=self._comments_since -
+                                    datetime.timedelta(seconds=1))
+
+        known = set(comment.id for comment in self._comments)
+        for comment in new:
+            if comment.id in known:
+                continue
+            self._comments.append(comment)
+            if self._comments_since is None or \
+                    comment.creation_time > self._comments_since:
+                self._comments_since = comment.creation_time
+        return self._comments
+
     def add_comment(self, comment):
         """
             Adds a comment to a bug. If the bug object does not have a bug ID
@@ -138,16 +343,24 @@ class Bug(object):
                                 )
         else:
             self._bug['comment'] = comment
+            self._dirty.add('comment')
 
-    def get_attachments(self):
+    def get_attachments(self, include_data=False):
         """
-            Obtain comments for this bug.
+            Obtain attachments for this bug.
 
-            Returns a list of Comment instances.
+            :param include_data: Also download the content of every
+                                 attachment. Defaults to False, in which case
+                                 only the metadata is fetched and the content
+                                 is downloaded when :attr:`Attachment.data` is
+                                 first used.
+
+            Returns a list of Attachment instances.
         """
         bug = str(self._bug['id'])
+        params = None if include_data else {'exclude_fields': 'data'}
         res = self._bugsy.request(
-            'bug/%s/attachment' % bug,
+            'bug/%s/attachment' % bug, params=params
         )
 
         return [Attachment(bugsy=self._bugsy, **attachments) for attachments
@@ -169,6 +382,70 @@ class Bug(object):
         self._bugsy.request('bug/%s/attachment' % self._bug['id'],
                             method='POST', json=output)
 
+    def add_attachment_from_file(self, path_or_fileobj, file_name=None,
+                                 summary=None, content_type=None,
+                                 chunk_size=3 * 64 * 1024, **kwargs):
+        """
+            Add an attachment whose content is read from a file. The content
+            is base64 encoded and sent a chunk at a time while the request
+            is being made, so large files never have to fit in memory.
+
+            :param path_or_fileobj: Path of the file, or a file object opened
+                                    in binary mode
+            :param file_name: Defaults to the name of the file
+            :param summary: Defaults to the file name
+            :param content_type: The MIME type of the content
+            :param chunk_size: Bytes read and encoded at a time
+            :param kwargs: Any other field from ``Attachment.CREATE_FIELDS``,
+                           like ``comment`` or ``is_patch``
+
+            >>> bug.add_attachment_from_file('crash.dmp',
+            ...                              content_type='application/octet-stream',
+            ...                              comment='Minidump of the crash')
+        """
+        if not self.id:
+            raise BugException("Cannot add an attachment without a bug id")
+
+        if file_name is None:
+            name = getattr(path_or_fileobj, 'name', path_or_fileobj)
+            if isinstance(name, six.string_types):
+                file_name = os.path.basename(name)
+        fields = dict(kwargs, file_name=file_name,
+                      summary=summary if summary is not None else file_name,
+                      content_type=content_type)
+        fields = dict((key, value) for key, value in fields.items()
+                      if value is not None)
+        unknown = set(fields) - set(Attachment.CREATE_FIELDS)
+        if unknown:
+            raise BugException("Unknown attachment fields: %s"
+                               % ', '.join(sorted(unknown)))
+        missing = set(Attachment.CREATE_REQUIRED) - set(fields) - set(['data'])
+        if missing:
+            raise BugException("Cannot add attachment without all required fields")
+
+        fields['ids'] = [self.id]
+        start = 0
+        if hasattr(path_or_fileobj, 'read'):
+            try:
+                start = path_or_fileobj.tell()
+            except (AttributeError, IOError, OSError):
+                start = None
+
+        if start is None:
+            # Can't go back to the start, so the body can only be sent once
+            body = _json_with_data(fields, path_or_fileobj, chunk_size)
+        else:
+            # Build the body again for every attempt so it can be retried
+            def body():
+                if hasattr(path_or_fileobj, 'seek'):
+                    path_or_fileobj.seek(start)
+                return _sized_json_with_data(fields, path_or_fileobj,
+                                             chunk_size)
+
+        self._bugsy.request('bug/%s/attachment' % self._bug['id'],
+                            method='POST', data=body,
+                            headers={'Content-Type': 'application/json'})
+
     def diff(self):
         """
             Generates a dictionary containing only the changed values
@@ -182,9 +459,14 @@ class Bug(object):
             ['foo@bar.com', 'abc@xyz.com']
             >>>bug.diff()
             {'cc': {'added': ['abc@xyz.com']}}
+
+            Only the fields that have been set, or changed in place, since
+            the bug was fetched are compared.
         """
         changed = {}
-        for key in self._bug:
+        for key in self._dirty:
+            if key not in self._bug:
+                continue
             if key not in ARRAY_TYPES:
                 if key not in self._copy or self._bug[key] != self._copy[key]:
                     changed[key] = self._bug[key]
@@ -219,8 +501,6 @@ class Comment(object):
 
     def __init__(self, bugsy=None, **kwargs):
         self._bugsy = bugsy
-        kwargs['time'] = str2datetime(kwargs['time'])
-        kwargs['creation_time'] = str2datetime(kwargs['creation_time'])
         if 'tags' in kwargs:
             kwargs['tags'] = set(kwargs['tags'])
         else:
@@ -283,7 +563,7 @@ class Comment(object):
 
             Prefer :attr:`creation_time` instead.
         """
-        return self._comment['time']
+        return self._datetime('time')
 
     @property
     def creation_time(self):
@@ -291,7 +571,15 @@ class Comment(object):
             Return the time (in Bugzilla's timezone) that the comment was
             added.
         """
-        return self._comment['creation_time']
+        return self._datetime('creation_time')
+
+    def _datetime(self, field):
+        # Times are only parsed the first time they are asked for
+        value = self._comment[field]
+        if isinstance(value, six.string_types):
+            value = str2datetime(value)
+            self._comment[field] = value
+        return value
 
     @property
     def is_private(self):
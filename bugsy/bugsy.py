@@ -1,8 +1,25 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 import requests
-from .bug import Bug
+import six
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+
+from .batch import BatchResult
+from .bug import Bug, Comment
+from .cache import cache_key
+from .dates import datetime2str
+from .identity import IdentityMap
+from .retry import RetryPolicy
 from .errors import (BugsyException, LoginException)
 from .search import Search
 
+_BUG_PATH = re.compile(r'^bug/(\d+)(?:/|$)')
+
 
 class Bugsy(object):
     """
@@ -13,6 +30,9 @@ class Bugsy(object):
                       'resolution', 'product', 'component', 'platform',
                       'whiteboard']
 
+    # Number of bugs whose comments are fetched in each request
+    COMMENT_CHUNK_SIZE = 100
+
     def __init__(
             self,
             username=None,
@@ -20,7 +40,17 @@ class Bugsy(object):
             userid=None,
             cookie=None,
             api_key=None,
-            bugzilla_url='https://bugzilla.mozilla.org/rest'
+            bugzilla_url='https://bugzilla.mozilla.org/rest',
+            pool_connections=DEFAULT_POOLSIZE,
+            pool_maxsize=DEFAULT_POOLSIZE,
+            pool_block=False,
+            timeout=None,
+            session=None,
+            adapter=None,
+            retry=True,
+            rate_limiter=None,
+            cache=None,
+            identity_map=None
     ):
         """
             Initialises a new instance of Bugsy
@@ -32,6 +62,37 @@ class Bugsy(object):
             :param apikey: API key to use. Defaults to None.
             :param bugzilla_url: URL endpoint to interact with. Defaults to
             https://bugzilla.mozilla.org/rest
+            :param pool_connections: Number of hosts to keep connection pools
+                                     for. Defaults to 10
+            :param pool_maxsize: Maximum number of connections kept open to a
+                                 host. Defaults to 10
+            :param pool_block: Whether to wait for a free connection when the
+                               pool is full instead of opening a throwaway
+                               one. Defaults to False
+            :param timeout: Seconds to wait for the server, either a number or
+                            a (connect, read) tuple. Defaults to None, which
+                            waits forever
+            :param session: A requests.Session to use instead of creating a
+                            new one. Defaults to None
+            :param adapter: A requests HTTPAdapter to mount on the session
+                            instead of creating one from the pool options.
+                            Defaults to None
+            :param retry: A :class:`RetryPolicy` describing how failed
+                          requests are retried. Defaults to True, a
+                          RetryPolicy() that only retries idempotent
+                          requests like GET. False turns retrying off
+            :param rate_limiter: A :class:`TokenBucket` every request has to
+                                 take a token from before being sent.
+                                 Defaults to None
+            :param cache: A :class:`ResponseCache`, like :class:`MemoryCache`
+                          or :class:`FileCache`, that GET responses are kept
+                          in and revalidated from. Writes to a bug make its
+                          cached responses stale. Defaults to None
+            :param identity_map: An :class:`IdentityMap` that keeps a single
+                                 Bug object per bug id, or True for one with
+                                 the default size. ``last_change_time`` is
+                                 then always asked for so the map can tell
+                                 when a bug changed. Defaults to None
 
             If a api_key is passed in, Bugsy will use this for authenticating
             requests. While not required to perform requests, if a username is
@@ -47,6 +108,14 @@ class Bugsy(object):
             token from them.
             If no username was passed in it will then try to get the username
             from Bugzilla.
+
+            Several Bugsy instances can share one warm connection pool by
+            passing in the same adapter. Passing in the same session works as
+            well but the session also carries the authentication headers, so
+            only share it between instances using the same credentials.
+
+            >>> adapter = requests.adapters.HTTPAdapter(pool_maxsize=50)
+            >>> bugzilla = Bugsy(api_key='...', adapter=adapter, timeout=30)
         """
         self.api_key = api_key
         self.username = username
@@ -55,8 +124,30 @@ class Bugsy(object):
         self.cookie = cookie
         self.bugzilla_url = bugzilla_url
         self.token = None
-        self.session = requests.Session()
+        self.timeout = timeout
+        if retry is True:
+            retry = RetryPolicy()
+        self.retry = retry or None
+        self.rate_limiter = rate_limiter
+        if identity_map is True:
+            identity_map = IdentityMap()
+        self.identity_map = identity_map
+        # Set once we are logged in so login responses are never cached
+        self.cache = None
+        if adapter is None and session is None:
+            adapter = HTTPAdapter(pool_connections=pool_connections,
+                                  pool_maxsize=pool_maxsize,
+                                  pool_block=pool_block)
+        self._own_session = session is None
+        self.session = requests.Session() if session is None else session
+        if adapter is not None:
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
         self._have_auth = False
+        self._pool_size = getattr(self.session.get_adapter(bugzilla_url),
+                                  '_pool_maxsize', DEFAULT_POOLSIZE)
+        self._thread_pool = None
+        self._thread_pool_lock = threading.Lock()
 
         # Prefer API keys over all other auth methods.
         if self.api_key:
@@ -106,6 +197,8 @@ class Bugsy(object):
 
             self._have_auth = True
 
+        self.cache = cache
+
     @property
     def authenticated(self):
         """
@@ -130,20 +223,33 @@ class Bugsy(object):
             >>> bugzilla = Bugsy()
             >>> bug = bugzilla.get(123456)
         """
+        return self._get(bug_number, include_fields)
+
+    def _get(self, bug_number, include_fields=None, fresh=False):
         fields = include_fields if include_fields else self.DEFAULT_SEARCH
         bug = self.request(
             'bug/%s' % bug_number,
-            params={"include_fields": fields}
+            params={"include_fields": self._include_fields(fields)},
+            fresh=fresh
         )
-        return Bug(self, **bug['bugs'][0])
+        return self._make_bug(bug['bugs'][0])
 
-    def put(self, bug):
+    def put(self, bug, refetch=True, include_fields=None):
         """
             This method allows you to create or update a bug on Bugzilla. You
             will have had to pass in a valid username and password to the
             object initialisation and recieved back a token.
 
             :param bug: A Bug object either created by hand or by using get()
+            :param refetch: When updating, get the bug again from Bugzilla
+                            and return it. If False the changes Bugzilla
+                            reports are applied to ``bug`` itself, which is
+                            returned without making another request.
+                            Defaults to True
+            :param include_fields: The fields to get when refetching, for
+                                   example ``list(bug.to_dict())`` to get back
+                                   the fields the bug already had. Defaults to
+                                   :attr:`DEFAULT_SEARCH`
 
             If there is no valid token then a BugsyException will be raised.
             If the object passed in is not a Bug then a BugsyException will
@@ -153,8 +259,23 @@ class Bugsy(object):
             >>> bug = bugzilla.get(123456)
             >>> bug.summary = "I like cheese and sausages"
             >>> bugzilla.put(bug)
+            >>> bugzilla.put(bug, refetch=False)
 
         """
+        self._check_put(bug)
+        if not bug.id:
+            self._created(bug, self.request('bug', 'POST',
+                                            json=bug.to_dict()))
+        else:
+            result = self.request('bug/%s' % bug.id, 'PUT',
+                                  json=bug.diff())
+            self._updated(bug, result)
+            if not refetch:
+                return bug
+            updated_bug = self._get(bug.id, include_fields, fresh=True)
+            return updated_bug
+
+    def _check_put(self, bug):
         if not self._have_auth:
             raise BugsyException("Unfortunately you can't put bugs in Bugzilla"
                                  " without credentials")
@@ -163,24 +284,269 @@ class Bugsy(object):
             raise BugsyException("Please pass in a Bug object when posting"
                                  " to Bugzilla")
 
-        if not bug.id:
-            result = self.request('bug', 'POST', json=bug.to_dict())
-            if 'error' not in result:
-                bug.id = result['id']
-                bug._bugsy = self
-                try:
-                    bug._bug.pop('comment')
-                except Exception:
-                    # If we don't have a `comment` we will error so let's just
-                    # swallow it.
-                    pass
-            else:
-                raise BugsyException(result['message'])
+    def _created(self, bug, result):
+        if 'error' not in result:
+            bug.id = result['id']
+            bug._bugsy = self
+            try:
+                bug._bug.pop('comment')
+            except Exception:
+                # If we don't have a `comment` we will error so let's just
+                # swallow it.
+                pass
         else:
-            result = self.request('bug/%s' % bug.id, 'PUT',
-                                  json=bug.diff())
-            updated_bug = self.get(bug.id)
-            return updated_bug
+            raise BugsyException(result['message'])
+
+    def _updated(self, bug, result):
+        changes = dict((change.get('id'), change)
+                       for change in result.get('bugs', []))
+        # Bugzilla has the changes now, they must not be sent again
+        bug._apply_changes(changes.get(bug.id, {}))
+
+    def put_many(self, bugs, refetch=True, include_fields=None):
+        """
+            Update several existing bugs with as few requests as possible.
+            Bugs with the same changes are updated together in a single PUT
+            and the updated bugs are then fetched again in one batched GET.
+            Bugs without any changes are not sent and are returned as they
+            were passed in.
+
+            :param bugs: A list of :class:`Bug` objects that have ids
+            :param refetch: If False the bugs are not fetched again, the
+                            changes Bugzilla reports are applied to the
+                            bugs passed in instead. Defaults to True
+            :param include_fields: A string or list of the fields to get when
+                                   refetching. Defaults to
+                                   :attr:`DEFAULT_SEARCH`
+            :returns: :class:`BatchResult` of bug id to the updated
+                      :class:`Bug`
+
+            >>> bugs = bugzilla.search_for.keywords("checkin-needed").search()
+            >>> for bug in bugs:
+            ...     bug.keywords.remove("checkin-needed")
+            >>> result = bugzilla.put_many(bugs)
+            >>> result.errors
+        """
+        if not self._have_auth:
+            raise BugsyException("Unfortunately you can't put bugs in Bugzilla"
+                                 " without credentials")
+
+        groups = OrderedDict()
+        by_id = OrderedDict()
+        for bug in bugs:
+            if not isinstance(bug, Bug):
+                raise BugsyException("Please pass in a Bug object when posting"
+                                     " to Bugzilla")
+            if not bug.id:
+                raise BugsyException("put_many() can only update bugs that "
+                                     "have an id, use put() to create them")
+            by_id[bug.id] = bug
+            diff = bug.diff()
+            groups.setdefault(_payload_key(diff), (diff, []))[1].append(bug.id)
+
+        result = BatchResult()
+        sent = set()
+        for diff, ids in groups.values():
+            if not diff:
+                continue
+            # Bugzilla has no PUT /bug, every bug listed in ids is updated
+            # whichever one is in the path.
+            payload = dict(diff, ids=ids)
+            try:
+                res = self.request('bug/%s' % ids[0], 'PUT', json=payload)
+            except BugsyException as e:
+                for bug_id in ids:
+                    result.errors[bug_id] = e
+                continue
+            sent.update(ids)
+            changes = dict((change.get('id'), change)
+                           for change in res.get('bugs', []))
+            for bug_id in ids:
+                by_id[bug_id]._apply_changes(changes.get(bug_id, {}))
+
+        updated = by_id.copy()
+        refresh = [bug_id for bug_id in by_id if bug_id in sent]
+        if refetch and refresh:
+            search = self.search_for.bug_number(refresh)
+            if isinstance(include_fields, six.string_types):
+                include_fields = [include_fields]
+            if include_fields:
+                search.only_fields(*include_fields)
+            search._fresh = True
+            for bug_id in refresh:
+                del updated[bug_id]
+            updated.update((bug.id, bug) for bug in search.search())
+            for fault in search.faults:
+                result.errors[fault['id']] = BugsyException(fault['message'],
+                                                            fault['code'])
+        for bug_id in by_id:
+            if bug_id in updated and bug_id not in result.errors:
+                result[bug_id] = updated[bug_id]
+        return result
+
+    def get_many(self, bug_numbers, include_fields=None, max_workers=None):
+        """
+            Get several bugs from Bugzilla at the same time using the shared
+            thread pool.
+
+            :param bug_numbers: A list of bug numbers to get
+            :param include_fields: A string or list of fields or field filters
+                                   to include in the response output
+            :param max_workers: The most requests to have in flight at once.
+                                Defaults to the size of the connection pool
+            :returns: :class:`BatchResult` of bug number to :class:`Bug`
+
+            >>> bugzilla = Bugsy()
+            >>> bugs = bugzilla.get_many([123456, 654321])
+            >>> bugs[123456].summary
+            >>> bugs.errors
+        """
+        return self._map(
+            lambda bug_number: self.get(bug_number, include_fields),
+            bug_numbers, bug_numbers, max_workers
+        )
+
+    def get_comments(self, bug_ids, new_since=None, chunk_size=None):
+        """
+            Get the comments for many bugs with as few requests as possible,
+            asking Bugzilla for the comments of a chunk of bugs at a time.
+
+            :param bug_ids: A list of bug ids
+            :param new_since: Only return comments made after this datetime.
+                              Defaults to None
+            :param chunk_size: How many bugs to ask about in each request.
+                               Defaults to :attr:`COMMENT_CHUNK_SIZE`
+            :returns: :class:`BatchResult` of bug id to a list of
+                      :class:`Comment`
+
+            >>> comments = bugzilla.get_comments([123456, 654321])
+            >>> comments[123456][0].text
+        """
+        result = BatchResult()
+        for chunk, path, params in self._comment_requests(bug_ids, new_since,
+                                                          chunk_size):
+            try:
+                res = self.request(path, params=params)
+            except BugsyException as e:
+                res = e
+            self._add_comments(result, chunk, res)
+        return result
+
+    def _comment_requests(self, bug_ids, new_since, chunk_size):
+        # The chunks of bugs get_comments() asks about and what to request
+        # for each of them
+        size = chunk_size or self.COMMENT_CHUNK_SIZE
+        bug_ids = list(bug_ids)
+        pending = []
+        for start in range(0, len(bug_ids), size):
+            chunk = bug_ids[start:start + size]
+            params = {'ids': chunk[1:]}
+            if new_since:
+                params['new_since'] = datetime2str(new_since)
+            pending.append((chunk, 'bug/%s/comment' % chunk[0], params))
+        return pending
+
+    def _add_comments(self, result, chunk, res):
+        # Record the comments of a chunk of bugs, res is the response or the
+        # BugsyException its request raised
+        if isinstance(res, BugsyException):
+            for bug_id in chunk:
+                result.errors[bug_id] = res
+            return
+
+        for bug_id in chunk:
+            comments = res['bugs'].get(str(bug_id))
+            if comments is None:
+                result.errors[bug_id] = BugsyException(
+                    "No comments were returned for bug %s" % bug_id)
+            else:
+                result[bug_id] = [Comment(bugsy=self, **comment)
+                                  for comment in comments['comments']]
+
+    def comments_for(self, bugs, max_workers=None):
+        """
+            Get the comments for several bugs at the same time using the shared
+            thread pool.
+
+            :param bugs: A list of :class:`Bug` objects
+            :param max_workers: The most requests to have in flight at once.
+                                Defaults to the size of the connection pool
+            :returns: :class:`BatchResult` of bug id to a list of
+                      :class:`Comment`
+
+            >>> comments = bugzilla.comments_for(bugs)
+            >>> comments[123456][0].text
+        """
+        return self._map(lambda bug: bug.get_comments(),
+                         bugs, [bug.id for bug in bugs], max_workers)
+
+    def attachments_for(self, bugs, max_workers=None):
+        """
+            Get the attachments for several bugs at the same time using the
+            shared thread pool.
+
+            :param bugs: A list of :class:`Bug` objects
+            :param max_workers: The most requests to have in flight at once.
+                                Defaults to the size of the connection pool
+            :returns: :class:`BatchResult` of bug id to a list of
+                      :class:`Attachment`
+        """
+        return self._map(lambda bug: bug.get_attachments(),
+                         bugs, [bug.id for bug in bugs], max_workers)
+
+    @property
+    def thread_pool(self):
+        """
+            The thread pool shared by the methods that work on many bugs at
+            once. It has as many threads as the session has pooled
+            connections, so every thread can reuse a warm connection.
+        """
+        with self._thread_pool_lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPool(self._pool_size)
+            return self._thread_pool
+
+    def close(self):
+        """
+            Stop the threads of the shared thread pool and, unless it was
+            passed in, close the session. Using the instance again starts a
+            new thread pool.
+
+            >>> with Bugsy(api_key='...') as bugzilla:
+            ...     bugs = bugzilla.get_many([123456, 654321])
+        """
+        with self._thread_pool_lock:
+            pool, self._thread_pool = self._thread_pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _map(self, func, items, keys, max_workers=None):
+        # Only allow max_workers tasks into the shared pool at once, the
+        # callback always fires as _call never raises.
+        window = threading.BoundedSemaphore(max_workers or self._pool_size)
+        pending = []
+        for item in items:
+            window.acquire()
+            pending.append(self.thread_pool.apply_async(
+                _call, (func, item), callback=lambda _: window.release()))
+
+        result = BatchResult()
+        for key, task in zip(keys, pending):
+            value, error = task.get()
+            if error is None:
+                result[key] = value
+            else:
+                result.errors[key] = error
+        return result
 
     @property
     def search_for(self):
@@ -192,24 +558,245 @@ class Bugsy(object):
         Given a relative Bugzilla URL path, an optional request method,
         and arguments suitable for requests.Request(), perform a
         HTTP request.
+
+        If this instance has a :class:`RetryPolicy` then connection errors
+        and transient server errors are retried as it describes. If it has a
+        rate limiter every attempt waits for its turn first. If it has a
+        cache then GET responses are served from and stored in it, unless
+        ``fresh`` is True in which case the response always comes from the
+        server. Any other request to a bug makes the cached responses about
+        that bug stale.
         """
+        fresh = kwargs.pop('fresh', False)
         headers = {} if headers is None else headers.copy()
         headers["User-Agent"] = "Bugsy"
         kwargs['headers'] = headers
+        kwargs.setdefault('timeout', self.timeout)
         url = '%s/%s' % (self.bugzilla_url, path)
-        return self._handle_errors(self.session.request(method, url, **kwargs))
+        if self.cache is None:
+            return self._handle_errors(self._retrying_send(method, url,
+                                                           **kwargs))
+        bug_ids = _bug_ids(path, kwargs.get('params'), kwargs.get('json'))
+        if method.upper() == 'GET':
+            return self._cached_request(url, bug_ids, fresh, **kwargs)
+        try:
+            return self._handle_errors(self._retrying_send(method, url,
+                                                           **kwargs))
+        finally:
+            # Even a failed write may have changed something
+            self._invalidate(bug_ids)
 
-    def _handle_errors(self, response):
-        if response.status_code >= 500:
-            raise BugsyException("We received a {0} error with the following: {1}"
-                                 .format(response.status_code, response.text))
-        result = response.json()
-        if (response.status_code > 399 and response.status_code < 500) \
-            or (isinstance(result, dict) and 'error' in result and
-                result.get('error', False) is True):
-
-            if "API key" in result['message'] or "username or password" in result['message']:
-                raise LoginException(result['message'], result.get("code"))
-            else:
-                raise BugsyException(result["message"], result.get("code"))
+    def stream(self, path, headers=None, **kwargs):
+        """Perform a GET request without reading the body.
+
+        Like request() but returns the requests.Response with its body
+        still unread, so that large responses can be consumed a piece at a
+        time with iter_content(). Errors are raised the same way as by
+        request(). Streamed responses are never cached.
+        """
+        headers = {} if headers is None else headers.copy()
+        headers["User-Agent"] = "Bugsy"
+        kwargs['headers'] = headers
+        kwargs['stream'] = True
+        kwargs.setdefault('timeout', self.timeout)
+        url = '%s/%s' % (self.bugzilla_url, path)
+        response = self._retrying_send('GET', url, **kwargs)
+        if response.status_code >= 400:
+            self._handle_errors(response)
+        return response
+
+    def _invalidate(self, bug_ids):
+        # Record when each bug was last written to. Cached responses about
+        # a bug that are older than that are not used again. The marks live
+        # in the cache so that every user and process sharing it sees them.
+        # A mark for any bug is kept as well, so a hit usually only needs
+        # to read that one.
+        now = time.time()
+        for bug_id in list(bug_ids) + (['*'] if bug_ids else []):
+            self.cache.set(_changed_key(bug_id), {
+                'body': '', 'etag': None, 'last_modified': None,
+                'stored': now, 'size': 0,
+            })
+
+    def _is_stale(self, entry):
+        if not entry.get('bugs'):
+            return False
+        latest = self.cache.get(_changed_key('*'))
+        if latest is None or latest['stored'] < entry['stored']:
+            return False
+        for bug_id in entry['bugs']:
+            mark = self.cache.get(_changed_key(bug_id))
+            if mark is not None and mark['stored'] >= entry['stored']:
+                return True
+        return False
+
+    def _cached_request(self, url, bug_ids, fresh, **kwargs):
+        params = kwargs.get('params')
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        prepared = self.session.prepare_request(
+            requests.Request('GET', url, params=params))
+        key = cache_key(self.api_key or self.token or self.username,
+                        prepared.url)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            # Entries asked to be fresh or about bugs written to since are
+            # revalidated even when they are younger than the ttl
+            stale = self._is_stale(entry)
+            if not (fresh or stale) and self.cache.is_fresh(entry):
+                return json.loads(entry['body'])
+            if entry.get('etag'):
+                kwargs['headers']['If-None-Match'] = entry['etag']
+            # Last-Modified only has a resolution of a second, too coarse to
+            # tell whether a response predates a write
+            if entry.get('last_modified') and not stale:
+                kwargs['headers']['If-Modified-Since'] = entry['last_modified']
+
+        response = self._retrying_send('GET', url, **kwargs)
+        if entry is not None and response.status_code == 304:
+            entry['stored'] = time.time()
+            self.cache.set(key, entry)
+            return json.loads(entry['body'])
+
+        result = self._handle_errors(response)
+        if response.status_code == 200:
+            self.cache.set(key, {
+                'body': response.text,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'stored': time.time(),
+                'size': len(response.content),
+                'bugs': bug_ids,
+            })
         return result
+
+    def _retrying_send(self, method, url, **kwargs):
+        # A callable body is called for a fresh body on every attempt, so
+        # streamed bodies can be sent again. A body that is an iterator can
+        # only be read once and is never retried.
+        body = kwargs.get('data')
+        if callable(body):
+            def attempt_kwargs():
+                return dict(kwargs, data=body())
+        else:
+            def attempt_kwargs():
+                return kwargs
+        one_shot = hasattr(body, '__next__') or hasattr(body, 'next')
+        if self.retry is None or one_shot:
+            return self._send(method, url, **attempt_kwargs())
+
+        self.retry._count_request()
+        attempt = 0
+        while True:
+            try:
+                response = self._send(method, url, **attempt_kwargs())
+            except requests.exceptions.ConnectionError:
+                if not self.retry.should_retry(method, attempt, 'connection'):
+                    raise
+                self.retry.sleep(attempt)
+            except requests.exceptions.ReadTimeout:
+                # The server may still have acted on the request, the policy
+                # only retries it if the method is safe to repeat
+                if not self.retry.should_retry(method, attempt, 'timeout'):
+                    raise
+                self.retry.sleep(attempt)
+            else:
+                if response.status_code not in self.retry.retry_statuses or \
+                        not self.retry.should_retry(method, attempt,
+                                                    response.status_code):
+                    return response
+                # Give the connection back to the pool instead of holding
+                # it while we wait, streamed bodies would never be read
+                response.close()
+                self.retry.sleep(attempt, response)
+            attempt += 1
+
+    def _include_fields(self, fields):
+        # The identity map needs last_change_time to tell whether a bug it
+        # already has is out of date
+        if self.identity_map is None:
+            return fields
+        if isinstance(fields, six.string_types):
+            fields = fields.split(',')
+        if not set(fields) & set(['last_change_time', '_default', '_all']):
+            fields = list(fields) + ['last_change_time']
+        return fields
+
+    def _make_bug(self, data):
+        # Every Bug built from data sent by Bugzilla goes through here so
+        # that it can be looked up in the identity map.
+        if self.identity_map is None:
+            return Bug(self, **data)
+        return self.identity_map.bug_for(self, data)
+
+    def _send(self, method, url, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.session.request(method, url, **kwargs)
+
+    def _handle_errors(self, response):
+        return _check_response(response.status_code, lambda: response.text,
+                               response.json)
+
+
+def _check_response(status_code, text, load):
+    # Return the JSON Bugzilla sent, raising the errors it reports. text and
+    # load are called for the body as text and parsed.
+    if status_code >= 500:
+        raise BugsyException("We received a {0} error with the following: {1}"
+                             .format(status_code, text()))
+    result = load()
+    if (status_code > 399 and status_code < 500) \
+        or (isinstance(result, dict) and 'error' in result and
+            result.get('error', False) is True):
+
+        if "API key" in result['message'] or "username or password" in result['message']:
+            raise LoginException(result['message'], result.get("code"))
+        else:
+            raise BugsyException(result["message"], result.get("code"))
+    return result
+
+
+def _bug_ids(path, params, body):
+    # The ids of the bugs a request is about, from the path and the id or
+    # ids parameters
+    ids = []
+    match = _BUG_PATH.match(path)
+    if match:
+        ids.append(match.group(1))
+    for source in (params, body):
+        if not isinstance(source, dict):
+            continue
+        for name in ('id', 'ids'):
+            value = source.get(name)
+            if isinstance(value, six.string_types):
+                value = value.split(',')
+            elif not isinstance(value, (list, tuple)):
+                value = [value] if value is not None else []
+            ids.extend(str(item) for item in value)
+    return sorted(set(item for item in ids if item.isdigit()))
+
+
+def _changed_key(bug_id):
+    return cache_key(None, 'changed bug %s' % bug_id)
+
+
+def _call(func, item):
+    try:
+        return func(item), None
+    except Exception as e:
+        return None, e
+
+
+def _payload_key(diff):
+    # Changes to list fields come out of sets in no particular order, sort
+    # them so that bugs with the same changes end up in the same group.
+    def normalise(value):
+        if isinstance(value, dict):
+            return dict((k, normalise(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return sorted((normalise(v) for v in value),
+                          key=lambda v: json.dumps(v, sort_keys=True))
+        return value
+    return json.dumps(normalise(diff), sort_keys=True)
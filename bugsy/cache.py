@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache(object):
+    """
+        Base class for caches of Bugzilla GET responses used by
+        :meth:`Bugsy.request`. Entries are dicts holding the response
+        ``body`` and the ``etag`` and ``last_modified`` validators sent by
+        the server, plus when they were ``stored`` and their ``size``.
+
+        Entries younger than ``ttl`` seconds are used without asking the
+        server. Older entries are revalidated with ``If-None-Match`` or
+        ``If-Modified-Since`` when the server gave us a validator.
+    """
+
+    def __init__(self, ttl=300, max_bytes=50 * 1024 * 1024):
+        """
+            :param ttl: Seconds a response is used without revalidating it.
+                        Defaults to 300
+            :param max_bytes: Total size of response bodies kept before the
+                              least recently used are evicted. Defaults to
+                              50MB
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def is_fresh(self, entry):
+        return time.time() - entry['stored'] < self.ttl
+
+    def get(self, key):
+        """
+            Return the entry stored for key, or None
+        """
+        raise NotImplementedError("%s must implement get()"
+                                  % type(self).__name__)
+
+    def set(self, key, entry):
+        """
+            Store entry for key, evicting old entries if needed
+        """
+        raise NotImplementedError("%s must implement set()"
+                                  % type(self).__name__)
+
+    def clear(self):
+        """
+            Remove every entry from the cache
+        """
+        raise NotImplementedError("%s must implement clear()"
+                                  % type(self).__name__)
+
+
+class MemoryCache(ResponseCache):
+    """
+        An in memory least recently used response cache
+
+        >>> bugzilla = Bugsy(cache=MemoryCache(ttl=60))
+    """
+
+    def __init__(self, ttl=300, max_bytes=50 * 1024 * 1024):
+        super(MemoryCache, self).__init__(ttl, max_bytes)
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old['size']
+            self._entries[key] = entry
+            self._size += entry['size']
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted['size']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class FileCache(ResponseCache):
+    """
+        A response cache kept on disk, one file per entry, so it can be
+        shared between processes and survives restarts. Files are touched
+        when read so the least recently used are evicted first.
+
+        The directory is only scanned for files to evict once the bytes this
+        instance thinks are stored go over ``max_bytes``, so files written
+        by other processes are only counted at the next scan.
+
+        >>> bugzilla = Bugsy(cache=FileCache('~/.cache/bugsy'))
+    """
+
+    def __init__(self, directory, ttl=300, max_bytes=50 * 1024 * 1024):
+        """
+            :param directory: Where to keep the cache files. It is created
+                              if it doesn't exist
+        """
+        super(FileCache, self).__init__(ttl, max_bytes)
+        self.directory = os.path.expanduser(directory)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # Bytes stored as of the last scan plus those written since, None
+        # until the first scan
+        self._size = None
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def set(self, key, entry):
+        data = json.dumps(entry)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        getattr(os, 'replace', os.rename)(tmp, self._path(key))
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            if self._size is None or self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def clear(self):
+        for name in self._files():
+            self._remove(name)
+        with self._lock:
+            self._size = None
+
+    def _evict(self):
+        # Once over max_bytes remove the least recently used files until
+        # they take up 90% of it, so the next scan isn't needed straight
+        # away. Returns how many bytes are left.
+        files = []
+        total = 0
+        for name in self._files():
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return total
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes * 0.9:
+                break
+            self._remove(name)
+            total -= size
+        return total
+
+    def _files(self):
+        return [name for name in os.listdir(self.directory)
+                if name.endswith('.json')]
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.json' % key)
+
+
+def cache_key(identity, url):
+    """
+        Build the key a response is cached under. The identity of the user
+        is part of the key so responses never leak between users, and it is
+        hashed so credentials are never written to disk.
+    """
+    key = '%s\n%s' % (identity or '', url)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
@@ -0,0 +1,199 @@
+from six.moves import intern
+
+from .attachment import Attachment
+from .bug import ARRAY_TYPES, Bug, Comment
+from .dates import str2datetime
+from .errors import BugException
+
+_MISSING = object()
+
+
+def _field_table(fields):
+    fields = tuple(intern(field) for field in fields)
+    return fields, dict((field, index) for index, field in enumerate(fields))
+
+
+def _freeze(value):
+    # Lists become tuples, they are smaller and can't be changed in place
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _restore(cls, bugsy, values, extra):
+    compact = object.__new__(cls)
+    object.__setattr__(compact, '_bugsy', bugsy)
+    object.__setattr__(compact, '_values', values)
+    object.__setattr__(compact, '_extra', extra)
+    return compact
+
+
+class _Compact(object):
+    """
+        Base for the read-only, memory compact representations. Values of
+        the standard fields live in a tuple indexed through a field table
+        shared by every instance, anything else in a small dict that is only
+        created when needed.
+    """
+    __slots__ = ('_bugsy', '_values', '_extra')
+
+    FIELDS, _INDEX = _field_table(())
+
+    def __init__(self, bugsy=None, **kwargs):
+        values = [_MISSING] * len(self.FIELDS)
+        extra = None
+        for key, value in kwargs.items():
+            index = self._INDEX.get(key)
+            if index is not None:
+                values[index] = _freeze(value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[intern(str(key))] = _freeze(value)
+        object.__setattr__(self, '_bugsy', bugsy)
+        object.__setattr__(self, '_values', tuple(values))
+        object.__setattr__(self, '_extra', extra)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        index = self._INDEX.get(attr)
+        if index is not None:
+            value = self._values[index]
+            return None if value is _MISSING else value
+        if self._extra is not None:
+            return self._extra.get(attr)
+        return None
+
+    def __setattr__(self, attr, value):
+        raise BugException("%s objects are read only" % type(self).__name__)
+
+    def __reduce__(self):
+        return _restore, (type(self), self._bugsy, self._values, self._extra)
+
+    def was_fetched(self, field):
+        """
+            Whether Bugzilla sent this field, see :meth:`Bug.was_fetched`
+        """
+        index = self._INDEX.get(field)
+        if index is not None:
+            return self._values[index] is not _MISSING
+        return self._extra is not None and field in self._extra
+
+    def to_dict(self):
+        """
+            Return a dict of the fields in this object. Lists of values are
+            returned as lists again.
+        """
+        result = {}
+        for field, value in zip(self.FIELDS, self._values):
+            if value is not _MISSING:
+                result[field] = value
+        if self._extra is not None:
+            result.update(self._extra)
+        for field, value in result.items():
+            if isinstance(value, tuple):
+                result[field] = list(value)
+        return result
+
+
+class CompactBug(_Compact):
+    """
+        A read-only :class:`Bug` that uses much less memory, for when lots
+        of bugs need to be held for analysis. Fields are read the same way
+        as on :class:`Bug`, with lists of values returned as tuples.
+
+        >>> bugs = bugzilla.search_for.product("Firefox").compact().search()
+        >>> bugs[0].summary
+        >>> bug = bugs[0].to_bug()  # when it needs changing
+    """
+    __slots__ = ()
+
+    FIELDS, _INDEX = _field_table(
+        ['id', 'summary', 'status', 'resolution', 'product', 'component',
+         'version', 'platform', 'op_sys', 'whiteboard', 'keywords',
+         'assigned_to', 'creator', 'qa_contact', 'creation_time',
+         'last_change_time', 'severity', 'priority', 'target_milestone',
+         'is_open', 'is_confirmed', 'classification', 'alias', 'dupe_of',
+         'url', 'cc', 'blocks', 'depends_on', 'flags', 'groups', 'see_also'])
+
+    def __init__(self, bugsy=None, **kwargs):
+        if 'cc_detail' in kwargs:
+            kwargs['cc'] = [item['email'] for item in kwargs.pop('cc_detail')]
+        for field in ARRAY_TYPES:
+            if field in kwargs and not kwargs[field]:
+                kwargs[field] = []
+        super(CompactBug, self).__init__(bugsy, **kwargs)
+
+    def __getattr__(self, attr):
+        value = super(CompactBug, self).__getattr__(attr)
+        if value is None and attr in ARRAY_TYPES:
+            # Like Bug, list fields that weren't sent read as empty
+            return ()
+        return value
+
+    def to_bug(self):
+        """
+            Return a full :class:`Bug` with the same fields, which can be
+            changed and put back into Bugzilla.
+        """
+        return Bug(self._bugsy, **self.to_dict())
+
+
+class CompactComment(_Compact):
+    """
+        A read-only :class:`Comment` that uses much less memory. ``time`` and
+        ``creation_time`` are returned as datetimes and ``tags`` as a
+        frozenset.
+    """
+    __slots__ = ()
+
+    FIELDS, _INDEX = _field_table(
+        ['id', 'bug_id', 'attachment_id', 'count', 'text', 'raw_text',
+         'author', 'creator', 'time', 'creation_time', 'is_private',
+         'is_markdown', 'tags'])
+
+    def __init__(self, bugsy=None, **kwargs):
+        kwargs['tags'] = frozenset(kwargs.get('tags') or ())
+        super(CompactComment, self).__init__(bugsy, **kwargs)
+
+    def __getattr__(self, attr):
+        value = super(CompactComment, self).__getattr__(attr)
+        if attr in ('time', 'creation_time') and value is not None:
+            return str2datetime(value)
+        return value
+
+    def to_comment(self):
+        """
+            Return a full :class:`Comment` with the same fields.
+        """
+        result = self.to_dict()
+        result['tags'] = list(result['tags'])
+        return Comment(bugsy=self._bugsy, **result)
+
+
+class CompactAttachment(_Compact):
+    """
+        A read-only :class:`Attachment` that uses much less memory.
+        ``creation_time`` and ``last_change_time`` are returned as
+        datetimes.
+    """
+    __slots__ = ()
+
+    FIELDS, _INDEX = _field_table(
+        ['id', 'bug_id', 'file_name', 'summary', 'description',
+         'content_type', 'size', 'creator', 'attacher', 'creation_time',
+         'last_change_time', 'is_obsolete', 'is_patch', 'is_private',
+         'flags', 'data'])
+
+    def __getattr__(self, attr):
+        value = super(CompactAttachment, self).__getattr__(attr)
+        if attr in ('creation_time', 'last_change_time') and value is not None:
+            return str2datetime(value)
+        return value
+
+    def to_attachment(self):
+        """
+            Return a full :class:`Attachment` with the same fields.
+        """
+        return Attachment(self._bugsy, **self.to_dict())
@@ -0,0 +1,33 @@
+import datetime
+
+BUGZILLA_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def str2datetime(s):
+    """
+        Turn a time sent by Bugzilla, like 2014-05-28T23:57:58Z, into a
+        datetime. Bugzilla always uses that exact format so the fields are
+        sliced out of the string directly, which is a lot quicker than
+        strptime. Anything else falls back to strptime.
+    """
+    if len(s) == 20 and s[4] == s[7] == '-' and s[10] == 'T' and \
+            s[13] == s[16] == ':' and s[19] == 'Z' and \
+            (s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] +
+             s[17:19]).isdigit():
+        try:
+            return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                                     int(s[11:13]), int(s[14:16]),
+                                     int(s[17:19]))
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(s, BUGZILLA_DATETIME_FORMAT)
+
+
+def datetime2str(value):
+    """
+        Turn a datetime into the format Bugzilla expects. Strings are assumed
+        to already be in that format and are returned as they are.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime(BUGZILLA_DATETIME_FORMAT)
+    return value
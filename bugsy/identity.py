@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+from .bug import Bug
+
+
+class IdentityMap(object):
+    """
+        Keeps a single :class:`Bug` instance per bug id so that getting the
+        same bug again, whether through :meth:`Bugsy.get`, a search or
+        :meth:`Bug.update`, hands back the object we already have instead of
+        building a new one.
+
+        Newly fetched fields are merged into the existing object and it is
+        only rebuilt when its ``last_change_time`` has moved forward. Bugs
+        that haven't been used for a while are forgotten once there are
+        more than ``maxsize`` of them.
+
+        >>> bugzilla = Bugsy(identity_map=IdentityMap(maxsize=5000))
+        >>> bugzilla.get(123456) is bugzilla.get(123456)
+        True
+    """
+
+    def __init__(self, maxsize=10000):
+        """
+            :param maxsize: The most bugs to keep. Defaults to 10000
+        """
+        self.maxsize = maxsize
+        self._bugs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._bugs)
+
+    def __contains__(self, bug_id):
+        return bug_id in self._bugs
+
+    def get(self, bug_id):
+        """
+            Return the bug we have for bug_id, or None
+        """
+        with self._lock:
+            bug = self._bugs.pop(bug_id, None)
+            if bug is not None:
+                self._bugs[bug_id] = bug
+            return bug
+
+    def bug_for(self, bugsy, data):
+        """
+            Return the :class:`Bug` for the data Bugzilla sent us, merging it
+            into the bug we already have if there is one.
+        """
+        bug_id = data.get('id')
+        if bug_id is None:
+            return Bug(bugsy, **data)
+
+        with self._lock:
+            bug = self._bugs.pop(bug_id, None)
+            if bug is None:
+                bug = Bug(bugsy, **data)
+            else:
+                bug._merge(data)
+            self._bugs[bug_id] = bug
+            while len(self._bugs) > self.maxsize:
+                self._bugs.popitem(last=False)
+        return bug
+
+    def discard(self, bug_id):
+        """
+            Forget the bug we have for bug_id, if any
+        """
+        with self._lock:
+            self._bugs.pop(bug_id, None)
+
+    def clear(self):
+        """
+            Forget every bug
+        """
+        with self._lock:
+            self._bugs.clear()
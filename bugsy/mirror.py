@@ -0,0 +1,444 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from .attachment import Attachment
+from .batch import BatchResult
+from .bug import Bug, Comment
+from .dates import datetime2str, str2datetime
+from .errors import BugsyException
+from .search import SearchCursor, _parse_time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bugs (
+    id INTEGER PRIMARY KEY,
+    product TEXT,
+    component TEXT,
+    status TEXT,
+    resolution TEXT,
+    assigned_to TEXT,
+    summary TEXT,
+    whiteboard TEXT,
+    creation_time TEXT,
+    last_change_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bugs_product ON bugs (product, component);
+CREATE INDEX IF NOT EXISTS bugs_component ON bugs (component);
+CREATE INDEX IF NOT EXISTS bugs_assigned_to ON bugs (assigned_to);
+CREATE INDEX IF NOT EXISTS bugs_last_change_time ON bugs (last_change_time);
+CREATE TABLE IF NOT EXISTS keywords (
+    keyword TEXT NOT NULL,
+    bug_id INTEGER NOT NULL,
+    PRIMARY KEY (keyword, bug_id)
+);
+CREATE INDEX IF NOT EXISTS keywords_bug_id ON keywords (bug_id);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY,
+    bug_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_bug_id ON comments (bug_id);
+CREATE TABLE IF NOT EXISTS attachments (
+    id INTEGER PRIMARY KEY,
+    bug_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_bug_id ON attachments (bug_id);
+CREATE TABLE IF NOT EXISTS cursors (
+    name TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL
+);
+"""
+
+# Bug fields kept in their own columns so they can be searched on
+_COLUMNS = ['product', 'component', 'status', 'resolution', 'assigned_to',
+            'summary', 'whiteboard', 'creation_time', 'last_change_time']
+
+
+def _encode(value):
+    # json.dumps() fallback for the values Comment and Attachment parse
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return datetime2str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+class Mirror(object):
+    """
+        A local copy of Bugzilla bugs, with their comments and attachment
+        metadata, kept in a SQLite database. sync() only downloads what
+        changed since the last time it ran, and searches made with
+        :attr:`search_for` run against the local copy, so they are quick
+        and work offline.
+
+        >>> mirror = Mirror(bugzilla, '~/.cache/bugsy/firefox.sqlite')
+        >>> mirror.sync(bugzilla.search_for.product("Firefox"))
+        >>> bugs = mirror.search_for\\
+        ...              .product("Firefox")\\
+        ...              .keywords("regression")\\
+        ...              .search()
+    """
+
+    # Fields asked for when syncing bugs
+    FIELDS = ['_default']
+
+    # Number of bugs whose attachments are asked for in each request
+    ATTACHMENT_CHUNK_SIZE = 100
+
+    def __init__(self, bugsy=None, path=':memory:'):
+        """
+            :param bugsy: Bugsy instance used to sync and to build the bugs
+                          returned. Defaults to None, which only allows
+                          searching what is already in the database
+            :param path: Where to keep the database. Defaults to keeping it
+                         in memory
+        """
+        self._bugsy = bugsy
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    @property
+    def search_for(self):
+        return LocalSearch(self)
+
+    def sync(self, search, name=None):
+        """
+            Bring the bugs matching search, a :class:`Search`, up to date.
+            Only bugs changed since the last sync with the same name are
+            downloaded, followed by the comments made since the newest one
+            already stored for each bug and the metadata of their
+            attachments. Nothing is stored unless everything was downloaded.
+
+            :param search: The :class:`Search` describing the bugs to mirror
+            :param name: What the progress of this search is saved as.
+                         Defaults to one made from the search parameters
+            :returns: A list of the bugs that were new or changed
+        """
+        if self._bugsy is None:
+            raise BugsyException("A Mirror needs a Bugsy instance to sync")
+        if name is None:
+            name = json.dumps(search._search_params(), sort_keys=True)
+
+        cursor = self._cursor(name)
+        bugs = cursor.search(search.only_fields(*self.FIELDS))
+        if not bugs:
+            return bugs
+
+        ids = [bug.id for bug in bugs]
+        # Comments up to the newest one stored for a bug are already in the
+        # mirror, whichever sync stored them
+        since = self._comments_since(ids)
+        by_since = OrderedDict()
+        for bug_id in ids:
+            by_since.setdefault(since.get(bug_id), []).append(bug_id)
+        comments = BatchResult()
+        for since, since_ids in by_since.items():
+            newer = self._bugsy.get_comments(since_ids, new_since=since)
+            comments.update(newer)
+            comments.errors.update(newer.errors)
+        for error in comments.errors.values():
+            raise error
+        attachments = self._attachments(ids)
+
+        with self._lock, self._db:
+            for bug in bugs:
+                self._store_bug(bug.to_dict())
+            for bug_id, bug_comments in comments.items():
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO comments (id, bug_id, data) "
+                    "VALUES (?, ?, ?)",
+                    [(comment.id, bug_id,
+                      json.dumps(comment._comment, default=_encode))
+                     for comment in bug_comments])
+            for bug_id, bug_attachments in attachments.items():
+                self._db.execute("DELETE FROM attachments WHERE bug_id = ?",
+                                 (bug_id,))
+                self._db.executemany(
+                    "INSERT INTO attachments (id, bug_id, data) "
+                    "VALUES (?, ?, ?)",
+                    [(attachment['id'], bug_id, json.dumps(attachment))
+                     for attachment in bug_attachments])
+            self._db.execute(
+                "INSERT OR REPLACE INTO cursors (name, cursor) VALUES (?, ?)",
+                (name, cursor.to_json()))
+        return bugs
+
+    def get(self, bug_id):
+        """
+            Return the mirrored :class:`Bug` with this id, or None
+        """
+        bugs = self.search_for.bug_number([bug_id]).search()
+        return bugs[0] if bugs else None
+
+    def get_comments(self, bug_id):
+        """
+            Return the mirrored comments of a bug as a list of
+            :class:`Comment`, oldest first
+        """
+        rows = self._query("SELECT data FROM comments WHERE bug_id = ? "
+                           "ORDER BY id", (bug_id,))
+        return [Comment(bugsy=self._bugsy, **json.loads(data))
+                for data, in rows]
+
+    def get_attachments(self, bug_id):
+        """
+            Return the mirrored attachments of a bug as a list of
+            :class:`Attachment`. Their content is downloaded from Bugzilla
+            when it is first asked for.
+        """
+        rows = self._query("SELECT data FROM attachments WHERE bug_id = ? "
+                           "ORDER BY id", (bug_id,))
+        return [Attachment(self._bugsy, **json.loads(data))
+                for data, in rows]
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _make_bug(self, data):
+        data = json.loads(data)
+        if self._bugsy is None:
+            return Bug(None, **data)
+        return self._bugsy._make_bug(data)
+
+    def _cursor(self, name):
+        rows = self._query("SELECT cursor FROM cursors WHERE name = ?",
+                           (name,))
+        if rows:
+            return SearchCursor.from_json(rows[0][0])
+        return SearchCursor()
+
+    def _newest_comments(self, ids):
+        # When the newest stored comment of each bug was made. Bugzilla's
+        # comment ids go up over time, so that is the one with the highest id.
+        newest = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self._query(
+                "SELECT bug_id, data FROM comments WHERE id IN "
+                "(SELECT MAX(id) FROM comments WHERE bug_id IN (%s) "
+                "GROUP BY bug_id)" % ', '.join('?' * len(chunk)), chunk)
+            for bug_id, data in rows:
+                newest[bug_id] = json.loads(data).get('creation_time')
+        return newest
+
+    def _comments_since(self, ids):
+        # Bugzilla only returns comments strictly newer than new_since, ask
+        # from a second before the newest stored comment so comments made
+        # later in that second aren't lost. The overlap is replaced.
+        since = {}
+        for bug_id, created in self._newest_comments(ids).items():
+            if created:
+                since[bug_id] = str2datetime(created) - \
+                    datetime.timedelta(seconds=1)
+        return since
+
+    def _attachments(self, ids):
+        # Attachment metadata for many bugs at once, the same way
+        # Bugsy.get_comments() gets comments
+        result = {}
+        size = self.ATTACHMENT_CHUNK_SIZE
+        for start in range(0, len(ids), size):
+            chunk = ids[start:start + size]
+            res = self._bugsy.request(
+                'bug/%s/attachment' % chunk[0],
+                params={'ids': chunk[1:], 'exclude_fields': 'data'})
+            for bug_id in chunk:
+                result[bug_id] = res['bugs'].get(str(bug_id), [])
+        return result
+
+    def _store_bug(self, data):
+        bug_id = data['id']
+        self._db.execute(
+            "INSERT OR REPLACE INTO bugs (id, %s, data) VALUES (?, %s, ?)"
+            % (', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))),
+            [bug_id] + [data.get(column) for column in _COLUMNS] +
+            [json.dumps(data, default=_encode)])
+        self._db.execute("DELETE FROM keywords WHERE bug_id = ?", (bug_id,))
+        self._db.executemany(
+            "INSERT OR IGNORE INTO keywords (keyword, bug_id) VALUES (?, ?)",
+            [(keyword, bug_id) for keyword in data.get('keywords') or []])
+
+
+class LocalSearch(object):
+    """
+        Searches the bugs in a :class:`Mirror`. It has the same methods as
+        :class:`Search`, so the same query can be run against Bugzilla or the
+        local copy.
+
+        >>> bugs = mirror.search_for\\
+        ...              .keywords("checkin-needed")\\
+        ...              .search()
+    """
+
+    def __init__(self, mirror):
+        self._mirror = mirror
+        self._keywords = []
+        self._component = []
+        self._product = []
+        self._assigned = []
+        self._summaries = []
+        self._whiteboard = []
+        self._bug_numbers = []
+        self._time_frame = {}
+
+    def include_fields(self, *args):
+        r"""
+            Every field that was mirrored is always returned, this is only
+            here so searches can be shared with :class:`Search`.
+
+            :returns: :class:`LocalSearch`
+        """
+        return self
+
+    def component(self, *components):
+        r"""
+            Limit results to bugs in any of these components
+
+            :returns: :class:`LocalSearch`
+        """
+        self._component.extend(components)
+        return self
+
+    def product(self, *products):
+        r"""
+            Limit results to bugs in any of these products
+
+            :returns: :class:`LocalSearch`
+        """
+        self._product.extend(products)
+        return self
+
+    def keywords(self, *args):
+        r"""
+            Limit results to bugs that have all of these keywords
+
+            :returns: :class:`LocalSearch`
+        """
+        self._keywords = list(args)
+        return self
+
+    def assigned_to(self, *args):
+        r"""
+            Limit results to bugs assigned to any of these users
+
+            :returns: :class:`LocalSearch`
+        """
+        self._assigned = list(args)
+        return self
+
+    def summary(self, *args):
+        r"""
+            Limit results to bugs whose summary contains every word passed
+            in, ignoring case
+
+            :returns: :class:`LocalSearch`
+        """
+        self._summaries = list(args)
+        return self
+
+    def whiteboard(self, *args):
+        r"""
+            Limit results to bugs whose whiteboard contains every word passed
+            in, ignoring case
+
+            :returns: :class:`LocalSearch`
+        """
+        self._whiteboard = list(args)
+        return self
+
+    def bug_number(self, bug_numbers):
+        r"""
+            Limit results to these bug numbers
+
+            :returns: :class:`LocalSearch`
+        """
+        self._bug_numbers = [int(bug) for bug in bug_numbers]
+        return self
+
+    def timeframe(self, start, end):
+        r"""
+            Limit results to bugs last changed within this time frame. The
+            mirror only keeps when a bug last changed, so unlike Bugzilla a
+            bug that changed in the time frame and again after it is not
+            found.
+
+            :param start: A datetime or date, or a string Bugzilla accepts
+            :param end: A datetime or date, or a string Bugzilla accepts
+            :returns: :class:`LocalSearch`
+        """
+        if start:
+            self._time_frame['start'] = datetime2str(_parse_time(start))
+        if end:
+            self._time_frame['end'] = datetime2str(_parse_time(end))
+        return self
+
+    def search(self):
+        r"""
+            Return the mirrored bugs that match, ordered by id
+        """
+        where, args = self._where()
+        rows = self._mirror._query("SELECT data FROM bugs%s ORDER BY id"
+                                   % where, args)
+        return [self._mirror._make_bug(data) for data, in rows]
+
+    def count(self):
+        r"""
+            Return how many mirrored bugs match
+        """
+        where, args = self._where()
+        return self._mirror._query("SELECT COUNT(*) FROM bugs%s" % where,
+                                   args)[0][0]
+
+    def ids(self):
+        r"""
+            Return the ids of the mirrored bugs that match, ordered by id
+        """
+        where, args = self._where()
+        rows = self._mirror._query("SELECT id FROM bugs%s ORDER BY id" % where,
+                                   args)
+        return [bug_id for bug_id, in rows]
+
+    def _where(self):
+        clauses = []
+        args = []
+        for column, values in (('id', self._bug_numbers),
+                               ('product', self._product),
+                               ('component', self._component),
+                               ('assigned_to', self._assigned)):
+            if values:
+                clauses.append('%s IN (%s)'
+                               % (column, ', '.join('?' * len(values))))
+                args.extend(values)
+        for keyword in self._keywords:
+            clauses.append('id IN (SELECT bug_id FROM keywords '
+                           'WHERE keyword = ?)')
+            args.append(keyword)
+        for column, values in (('summary', self._summaries),
+                               ('whiteboard', self._whiteboard)):
+            for value in values:
+                for word in value.split():
+                    clauses.append("%s LIKE ? ESCAPE '\\'" % column)
+                    args.append('%%%s%%' % word.replace('\\', '\\\\')
+                                .replace('%', '\\%').replace('_', '\\_'))
+        if 'start' in self._time_frame:
+            clauses.append('last_change_time >= ?')
+            args.append(self._time_frame['start'])
+        if 'end' in self._time_frame:
+            clauses.append('last_change_time <= ?')
+            args.append(self._time_frame['end'])
+        if not clauses:
+            return '', args
+        return ' WHERE ' + ' AND '.join(clauses), args
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .errors import BugsyException
+
+
+class TokenBucket(object):
+    """
+        A client side rate limiter for :meth:`Bugsy.request`. The bucket
+        holds up to ``burst`` tokens and is refilled at ``rate`` tokens per
+        second. Each request takes a token, waiting for one if the bucket is
+        empty.
+
+        >>> bugzilla = Bugsy(rate_limiter=TokenBucket(rate=5, burst=10))
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+            :param rate: Requests per second allowed on average
+            :param burst: Most requests that can be made at once after being
+                          idle. Defaults to ``rate`` (and at least 1)
+        """
+        if rate <= 0:
+            raise BugsyException("rate should be a positive number")
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(1, rate))
+        self._tokens = self.burst
+        self._updated = self._now()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+            Take ``tokens`` from the bucket, blocking until they are
+            available.
+        """
+        while True:
+            with self._lock:
+                wait = self._take(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def _take(self, tokens):
+        # Returns how long to wait before trying again, or 0 if the tokens
+        # were taken.
+        now = self._now()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0
+        return (tokens - self._tokens) / self.rate
+
+    def _now(self):
+        return time.time()
+
+
+class FileTokenBucket(TokenBucket):
+    """
+        A :class:`TokenBucket` whose state lives in a file guarded by a file
+        lock, so every process on the machine using the same path shares one
+        requests-per-second budget.
+
+        >>> limiter = FileTokenBucket('/tmp/bugzilla.bucket', rate=10)
+        >>> bugzilla = Bugsy(api_key='...', rate_limiter=limiter)
+    """
+
+    def __init__(self, path, rate, burst=None):
+        """
+            :param path: File used to share the bucket between processes. It
+                         is created if it doesn't exist
+            :param rate: Requests per second allowed on average across all
+                         processes
+            :param burst: Most requests that can be made at once after being
+                          idle. Defaults to ``rate`` (and at least 1)
+        """
+        if fcntl is None:
+            raise BugsyException("FileTokenBucket needs file locking, which "
+                                 "isn't available on this platform")
+        super(FileTokenBucket, self).__init__(rate, burst)
+        self.path = path
+
+    def _take(self, tokens):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.read(fd, 64).decode('ascii').split()
+            if len(state) == 2:
+                self._tokens, self._updated = float(state[0]), float(state[1])
+            else:
+                self._tokens, self._updated = self.burst, self._now()
+            wait = super(FileTokenBucket, self)._take(tokens)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, ('%r %r' % (self._tokens, self._updated)).encode('ascii'))
+            return wait
+        finally:
+            os.close(fd)
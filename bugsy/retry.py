@@ -0,0 +1,139 @@
+import email.utils
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """
+        Describes when and how :meth:`Bugsy.request` retries a request that
+        failed with a connection error, timed out waiting for the response or
+        got a transient server error.
+
+        Waits between attempts grow exponentially with random jitter so that
+        many clients retrying at once don't all hit the server together. If
+        the server sends a ``Retry-After`` header that is used instead.
+
+        >>> policy = RetryPolicy(max_retries=5)
+        >>> bugzilla = Bugsy(retry=policy)
+        >>> bug = bugzilla.get(123456)
+        >>> policy.counters
+        {'requests': 1, 'retries': 0, 'exhausted': 0, 'reasons': {}}
+    """
+
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'DELETE'])
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(
+            self,
+            max_retries=3,
+            backoff_factor=0.5,
+            max_backoff=60,
+            jitter=True,
+            retry_statuses=RETRY_STATUSES,
+            retry_non_idempotent=False
+    ):
+        """
+            :param max_retries: How many times a request is retried before
+                                giving up. Defaults to 3
+            :param backoff_factor: Seconds to wait before the first retry, it
+                                   doubles for each retry after that.
+                                   Defaults to 0.5
+            :param max_backoff: The longest we will wait between attempts,
+                                unless told otherwise by Retry-After.
+                                Defaults to 60
+            :param jitter: Wait a random time between 0 and the backoff
+                           instead of the full backoff. Defaults to True
+            :param retry_statuses: HTTP status codes that are retried.
+                                   Defaults to 429, 500, 502, 503 and 504
+            :param retry_non_idempotent: Also retry POST and PUT requests,
+                                         which may apply the change twice.
+                                         Defaults to False
+        """
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_non_idempotent = retry_non_idempotent
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def counters(self):
+        """
+            A snapshot of how many requests were made, how many times they
+            were retried, how many gave up after running out of retries and
+            the reasons (status code, ``'connection'`` or ``'timeout'``) for
+            retrying.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters['reasons'] = dict(self._counters['reasons'])
+            return counters
+
+    def reset(self):
+        """
+            Set all the counters back to zero.
+        """
+        with self._lock:
+            self._counters = {'requests': 0, 'retries': 0, 'exhausted': 0,
+                              'reasons': {}}
+
+    def retries_method(self, method):
+        """
+            True if requests with this HTTP method may be retried.
+        """
+        return (self.retry_non_idempotent or
+                method.upper() in self.IDEMPOTENT_METHODS)
+
+    def should_retry(self, method, attempt, reason):
+        """
+            Decide whether attempt number ``attempt`` (starting at 0) of a
+            request that failed for ``reason`` should be retried, and record
+            the outcome in the counters.
+        """
+        if not self.retries_method(method):
+            return False
+        with self._lock:
+            if attempt >= self.max_retries:
+                self._counters['exhausted'] += 1
+                return False
+            self._counters['retries'] += 1
+            reasons = self._counters['reasons']
+            reasons[reason] = reasons.get(reason, 0) + 1
+        return True
+
+    def backoff(self, attempt, response=None):
+        """
+            Seconds to wait before retrying attempt number ``attempt``.
+        """
+        retry_after = self._retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def sleep(self, attempt, response=None):
+        time.sleep(self.backoff(attempt, response))
+
+    def _count_request(self):
+        with self._lock:
+            self._counters['requests'] += 1
+
+    def _retry_after(self, response):
+        if response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            pass
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, email.utils.mktime_tz(date) - time.time())
@@ -1,13 +1,29 @@
 import copy
+import datetime
+import json
+from collections import OrderedDict
 
-from .bug import Bug
-from .errors import SearchException
+from .compact import CompactBug
+from .dates import datetime2str, str2datetime
+from .errors import BugsyException, SearchException
 
 
 class Search(object):
     """
         This allows searching for bugs in Bugzilla
     """
+
+    # Number of ids sent in each ``GET bug?id=...`` request when searching
+    # by bug number. Keeps the query string under common URL length limits.
+    BUG_NUMBER_CHUNK_SIZE = 200
+
+    # Number of bugs requested per page by iter_search()
+    PAGE_SIZE = 1000
+
+    # Most bugs asked for in each window by sharded_search(). A window that
+    # returns this many may have been cut short, so it is split in two.
+    SHARD_LIMIT = 10000
+
     def __init__(self, bugsy):
         """
             Initialises the search object
@@ -16,6 +32,9 @@ class Search(object):
         """
         self._bugsy = bugsy
         self._includefields = copy.copy(bugsy.DEFAULT_SEARCH)
+        self._excludefields = []
+        self._fresh = False
+        self._order = 'bug_id'
         self._keywords = []
         self._component = []
         self._product = []
@@ -23,7 +42,11 @@ class Search(object):
         self._summaries = []
         self._whiteboard = []
         self._bug_numbers = []
+        self._bug_number_chunk_size = self.BUG_NUMBER_CHUNK_SIZE
+        self._faults = []
+        self._compact = False
         self._time_frame = {}
+        self._changed_since = None
         self._change_history = {"fields": []}
 
     def include_fields(self, *args):
@@ -45,6 +68,44 @@ class Search(object):
             self._includefields.append(arg)
         return self
 
+    def only_fields(self, *args):
+        r"""
+            Replace the fields returned when searching, rather than adding to
+            the default ones like include_fields() does, so responses only
+            carry what is needed. ``id`` is always included. Bugzilla's
+            ``_default``, ``_all`` and ``_custom`` field groups can be used
+            as well as field names.
+
+            :param args: items passed in will be turned into a list
+            :returns: :class:`Search`
+
+            >>> bugzilla.search_for.only_fields("summary", "status")
+            >>> bugzilla.search_for.only_fields("_default", "flags")
+
+            Fields that weren't asked for read as None on the bugs returned,
+            or as an empty list for list fields like ``keywords``, use
+            :meth:`Bug.was_fetched` to tell them apart from empty ones.
+        """
+        self._includefields = list(args)
+        if 'id' not in self._includefields:
+            self._includefields.insert(0, 'id')
+        return self
+
+    def exclude_fields(self, *args):
+        r"""
+            Leave these fields out of the bugs returned when searching, for
+            example to drop large fields from the ``_all`` group. ``id`` is
+            never excluded.
+
+            :param args: items passed in will be turned into a list
+            :returns: :class:`Search`
+
+            >>> bugzilla.search_for.only_fields("_all")\
+            ...                    .exclude_fields("_custom", "cc")
+        """
+        self._excludefields = [field for field in args if field != 'id']
+        return self
+
     def component(self, *components):
         r"""
             When search() is called it will limit results to items in a component.
@@ -119,20 +180,56 @@ class Search(object):
         self._whiteboard = list(args)
         return self
 
-    def bug_number(self, bug_numbers):
+    def bug_number(self, bug_numbers, chunk_size=None):
         r"""
             When you want to search for a bugs and be able to change the fields
             returned.
 
             :param bug_numbers: A string for the bug number or a list of
                                 strings
+            :param chunk_size: How many bug numbers are sent to Bugzilla in
+                               each request. Defaults to
+                               :attr:`BUG_NUMBER_CHUNK_SIZE`
             :returns: :class:`Search`
 
             >>> bugzilla.search_for.bug_number(['123123', '123456'])
         """
+        if chunk_size is not None and chunk_size < 1:
+            raise SearchException("chunk_size should be a positive number")
         self._bug_numbers = list(bug_numbers)
+        if chunk_size:
+            self._bug_number_chunk_size = chunk_size
         return self
 
+    def compact(self, compact=True):
+        r"""
+            Return :class:`CompactBug` objects instead of :class:`Bug`
+            objects. They are read only but use much less memory, which helps
+            when holding on to a lot of bugs.
+
+            :param compact: Whether to return compact bugs. Defaults to True
+            :returns: :class:`Search`
+
+            >>> bugzilla.search_for.product("Firefox").compact().search()
+        """
+        self._compact = compact
+        return self
+
+    @property
+    def faults(self):
+        r"""
+            Bug numbers that could not be returned by the last call to
+            search(). Each fault is a dict with the requested ``id`` and the
+            ``message`` and ``code`` explaining why, for example because the
+            bug does not exist or we are not allowed to see it.
+
+            >>> search = bugzilla.search_for.bug_number([123456, 1])
+            >>> bugs = search.search()
+            >>> search.faults
+            [{'id': 1, 'message': 'Bug 1 does not exist ...', 'code': None}]
+        """
+        return self._faults
+
     def timeframe(self, start, end):
         r"""
             When you want to search bugs for a certain time frame.
@@ -147,6 +244,20 @@ class Search(object):
             self._time_frame['chfieldto'] = end
         return self
 
+    def changed_since(self, since):
+        r"""
+            When search() is called it will only return bugs that have
+            changed at or after this time.
+
+            :param since: A datetime, or a string in Bugzilla's format
+            :returns: :class:`Search`
+
+            >>> bugzilla.search_for.product("Firefox")\
+            ...                    .changed_since(datetime(2016, 1, 1))
+        """
+        self._changed_since = since
+        return self
+
     def change_history_fields(self, fields, value=None):
         r"""
 
@@ -172,42 +283,400 @@ class Search(object):
             ...                .include_fields("flags")\
             ...                .search()
         """
+        params = self._search_params()
+        self._faults = []
+        if self._bug_numbers:
+            return list(self._iter_bug_numbers(params,
+                                               self._bug_number_chunk_size))
+
+        results = self._request(params)
+        return [self._make_bug(bug) for bug in results['bugs']]
+
+    def iter_search(self, page_size=None):
+        r"""
+            Like search() but walks through the results a page at a time
+            using Bugzilla's ``limit`` and ``offset`` parameters, yielding
+            :class:`Bug` objects as each page arrives. Only one page is held
+            in memory at a time.
+
+            :param page_size: How many bugs to request per page. Defaults to
+                              :attr:`PAGE_SIZE`
+
+            >>> for bug in bugzilla.search_for\
+            ...                    .product("Firefox")\
+            ...                    .iter_search(page_size=500):
+            ...     print(bug.summary)
+        """
+        page_size = page_size or self.PAGE_SIZE
+        if page_size < 1:
+            raise SearchException("page_size should be a positive number")
+
+        params = self._search_params()
+        self._faults = []
+        if self._bug_numbers:
+            for bug in self._iter_bug_numbers(params, page_size):
+                yield bug
+            return
+
+        # Sort by id so that pages don't overlap or skip bugs
+        params['order'] = self._order
+        offset = 0
+        while True:
+            params['limit'] = page_size
+            params['offset'] = offset
+            results = self._request(params)
+            for bug in results['bugs']:
+                yield self._make_bug(bug)
+            if len(results['bugs']) < page_size:
+                break
+            offset += page_size
+
+    def count(self):
+        r"""
+            Return how many bugs match this search without getting them,
+            using Bugzilla's ``count_only`` parameter.
+
+            >>> bugzilla.search_for.keywords("checkin-needed").count()
+            12
+        """
+        if self._bug_numbers:
+            return len(self.ids())
+        params = self._search_params()
+        params.pop('include_fields', None)
+        params.pop('exclude_fields', None)
+        params['count_only'] = 1
+        return int(self._request(params)['bug_count'])
+
+    def ids(self):
+        r"""
+            Return the ids of the bugs that match this search as a list of
+            ints. Only the ``id`` field is asked for and no :class:`Bug`
+            objects are built.
+
+            >>> bugzilla.search_for.keywords("checkin-needed").ids()
+            [123456, 654321]
+        """
+        params = self._search_params()
+        params['include_fields'] = 'id'
+        params.pop('exclude_fields', None)
+        self._faults = []
+        if self._bug_numbers:
+            return list(self._iter_bug_numbers(params,
+                                               self._bug_number_chunk_size,
+                                               lambda bug: int(bug['id'])))
+        return [int(bug['id']) for bug in self._request(params)['bugs']]
+
+    def sharded_search(self, shards=4, limit=None, max_workers=None):
+        r"""
+            Like search() but splits the range given to timeframe() into
+            ``shards`` smaller windows and searches them at the same time
+            using the shared thread pool, which is kinder to the server than
+            one big search. A bug found in more than one window is only
+            returned once. A window that returns ``limit`` bugs may have been
+            cut short, so it is split in two and searched again.
+
+            :param shards: How many windows to split the time frame into.
+                           Defaults to 4
+            :param limit: Most bugs asked for in each window. Defaults to
+                          :attr:`SHARD_LIMIT`
+            :param max_workers: The most requests to have in flight at once.
+                                Defaults to the size of the connection pool
+            :returns: A list of bugs ordered by id
+
+            >>> bugs = bugzilla.search_for\
+            ...                .product("Firefox")\
+            ...                .timeframe('2014-01-01', '2015-01-01')\
+            ...                .sharded_search(shards=12)
+
+            To shard on when bugs were created rather than changed:
+
+            >>> bugs = bugzilla.search_for\
+            ...                .change_history_fields(['[Bug creation]'])\
+            ...                .timeframe('2014-01-01', '2015-01-01')\
+            ...                .sharded_search()
+        """
+        if self._bug_numbers:
+            return self.search()
+        limit = limit or self.SHARD_LIMIT
+        windows = self._shard_windows(shards)
+
+        params = self._search_params()
+        self._faults = []
+        found = {}
+        while windows:
+            results = self._bugsy._map(
+                lambda window: self._search_window(params, window, limit),
+                windows, windows, max_workers
+            )
+            for error in results.errors.values():
+                raise error
+            windows = self._windows_cut_short(results.items(), found, limit)
+        return [self._make_bug(found[bug_id]) for bug_id in sorted(found)]
+
+    def _shard_windows(self, shards):
+        # The windows sharded_search() starts with
+        if shards < 1:
+            raise SearchException("shards should be a positive number")
+        start = _parse_time(self._time_frame.get('chfieldfrom'))
+        end = _parse_time(self._time_frame.get('chfieldto', 'Now'))
+        if start is None:
+            raise SearchException("sharded_search() needs the start of a "
+                                  "time frame, see timeframe()")
+        return _split_window(start, end, shards)
+
+    def _windows_cut_short(self, results, found, limit):
+        # Add the bugs each (window, bugs) pair found to found, returning
+        # the windows that hit the limit split in two to search again
+        windows = []
+        for window, bugs in results:
+            for bug in bugs:
+                found[bug['id']] = bug
+            if len(bugs) >= limit:
+                if window[1] - window[0] <= datetime.timedelta(seconds=1):
+                    raise SearchException(
+                        "More than %s bugs changed between %s and %s, "
+                        "use a larger limit" % (limit, window[0], window[1]))
+                windows.extend(_split_window(window[0], window[1], 2))
+        return windows
+
+    def _search_window(self, params, window, limit):
+        return self._request(_window_params(params, window, limit))['bugs']
+
+    def _search_params(self):
+        """
+            Build up the query string parameters for this search
+        """
         params = {}
         params.update(self._time_frame.items())
 
         if self._includefields:
-            params['include_fields'] = list(self._includefields)
+            params['include_fields'] = self._bugsy._include_fields(
+                list(self._includefields))
+        if self._excludefields:
+            params['exclude_fields'] = list(self._excludefields)
         if self._bug_numbers:
-            bugs = []
-            for bug in self._bug_numbers:
-                result = self._bugsy.request('bug/%s' % bug,
-                                             params=params)
-                bugs.append(Bug(self._bugsy, **result['bugs'][0]))
-
-            return bugs
-        else:
-            if self._component:
-                params['component'] = list(self._component)
-            if self._product:
-                params['product'] = list(self._product)
-            if self._keywords:
-                params['keywords'] = list(self._keywords)
-            if self._assigned:
-                params['assigned_to'] = list(self._assigned)
-            if self._summaries:
-                params['short_desc_type'] = 'allwordssubstr'
-                params['short_desc'] = list(self._summaries)
-            if self._whiteboard:
-                params['short_desc_type'] = 'allwordssubstr'
-                params['whiteboard'] = list(self._whiteboard)
-            if self._change_history['fields']:
-                params['chfield'] = self._change_history['fields']
-            if self._change_history.get('value', None):
-                params['chfieldvalue'] = self._change_history['value']
-
+            return params
+
+        if self._component:
+            params['component'] = list(self._component)
+        if self._product:
+            params['product'] = list(self._product)
+        if self._keywords:
+            params['keywords'] = list(self._keywords)
+        if self._assigned:
+            params['assigned_to'] = list(self._assigned)
+        if self._summaries:
+            params['short_desc_type'] = 'allwordssubstr'
+            params['short_desc'] = list(self._summaries)
+        if self._whiteboard:
+            params['short_desc_type'] = 'allwordssubstr'
+            params['whiteboard'] = list(self._whiteboard)
+        if self._changed_since:
+            params['last_change_time'] = datetime2str(self._changed_since)
+        if self._change_history['fields']:
+            params['chfield'] = self._change_history['fields']
+        if self._change_history.get('value', None):
+            params['chfieldvalue'] = self._change_history['value']
+        return params
+
+    def _make_bug(self, data):
+        if self._compact:
+            return CompactBug(self._bugsy, **data)
+        return self._bugsy._make_bug(data)
+
+    def _request(self, params):
+        try:
+            return self._bugsy.request('bug', params=params,
+                                       fresh=self._fresh)
+        except Exception as e:
+            raise SearchException(e.msg, e.code)
+
+    def _iter_bug_numbers(self, params, chunk_size, make_bug=None):
+        """
+            Fetch the bugs in ``_bug_numbers`` with as few requests as
+            possible. Bugs are yielded in the order they were asked for
+            and anything Bugzilla doesn't give back is recorded in
+            :attr:`faults` instead of aborting the whole batch.
+        """
+        for chunk, chunk_params in self._bug_number_chunks(params, chunk_size):
             try:
-                results = self._bugsy.request('bug', params=params)
-            except Exception as e:
-                raise SearchException(e.msg, e.code)
+                result = self._bugsy.request('bug', params=chunk_params,
+                                             fresh=self._fresh)
+            except BugsyException as e:
+                result = e
+            for bug in self._chunk_bugs(chunk, result, make_bug):
+                yield bug
+
+    def _bug_number_chunks(self, params, chunk_size):
+        for start in range(0, len(self._bug_numbers), chunk_size):
+            chunk = self._bug_numbers[start:start + chunk_size]
+            chunk_params = dict(params)
+            chunk_params['id'] = ','.join(str(bug) for bug in chunk)
+            yield chunk, chunk_params
+
+    def _chunk_bugs(self, chunk, result, make_bug=None):
+        # The bugs of a chunk in the order they were asked for, result is
+        # the response or the BugsyException its request raised
+        found = {}
+        failed = {}
+        if isinstance(result, BugsyException):
+            for bug in chunk:
+                failed[str(bug)] = {'message': result.msg, 'code': result.code}
+            result = {}
+
+        for bug in result.get('bugs', []):
+            found[str(bug['id'])] = bug
+        for fault in result.get('faults', []):
+            failed[str(fault['id'])] = {'message': fault.get('faultString'),
+                                        'code': fault.get('faultCode')}
+
+        bugs = []
+        for bug in chunk:
+            key = str(bug)
+            if key in found:
+                bugs.append((make_bug or self._make_bug)(found[key]))
+            else:
+                fault = failed.get(key, {
+                    'message': "Bug %s does not exist or you are not "
+                               "authorized to access it" % bug,
+                    'code': None
+                })
+                self._faults.append(dict(id=bug, **fault))
+        return bugs
+
+
+_WINDOW_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _window_params(params, window, limit):
+    # The parameters to search one window of a sharded_search()
+    params = dict(params)
+    params['chfieldfrom'] = window[0].strftime(_WINDOW_FORMAT)
+    params['chfieldto'] = window[1].strftime(_WINDOW_FORMAT)
+    params['limit'] = limit
+    return params
+
+
+def _parse_time(value):
+    # Turn a value given to timeframe() into a datetime
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if value.lower() == 'now':
+        return datetime.datetime.utcnow().replace(microsecond=0)
+    for parse in (str2datetime,
+                  lambda v: datetime.datetime.strptime(v, _WINDOW_FORMAT),
+                  lambda v: datetime.datetime.strptime(v, '%Y-%m-%d')):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    raise SearchException("Can't split the time frame at %r" % value)
+
+
+def _split_window(start, end, parts):
+    # Split start to end into parts windows on whole seconds. Bugzilla
+    # includes both ends of a window so neighbours share their boundary.
+    step = (end - start) / parts
+    edges = [(start + step * i).replace(microsecond=0) for i in range(parts)]
+    edges.append(end)
+    return [(a, b) for a, b in zip(edges, edges[1:]) if a < b] or [(start, end)]
+
+
+class SearchCursor(object):
+    """
+        Remembers how far a repeated search has got, so that each run only
+        returns bugs that changed since the last one. It keeps the newest
+        ``last_change_time`` seen and the ids of the bugs that changed at
+        exactly that time, because Bugzilla's ``last_change_time`` filter
+        includes that instant and those bugs would otherwise come back.
+
+        >>> cursor = SearchCursor()
+        >>> bugs = cursor.search(bugzilla.search_for.product("Firefox"))
+        >>> saved = cursor.to_json()
+        >>> # on the next run
+        >>> cursor = SearchCursor.from_json(saved)
+        >>> bugs = cursor.search(bugzilla.search_for.product("Firefox"))
+    """
+
+    def __init__(self, last_change_time=None, seen_ids=()):
+        """
+            :param last_change_time: Where to start from, a datetime or a
+                                     string in Bugzilla's format. Defaults
+                                     to None, which returns every bug the
+                                     first time
+            :param seen_ids: Ids of bugs already returned that changed at
+                             exactly ``last_change_time``
+        """
+        self.last_change_time = datetime2str(last_change_time)
+        self.seen_ids = set(seen_ids)
+
+    def search(self, search):
+        """
+            Run search, a :class:`Search`, limited to bugs changed since the
+            last run and move the cursor past the bugs it returns.
+
+            Every page of results is read, oldest change first, before the
+            cursor moves, so a server that caps how many bugs it returns
+            can't make it skip bugs. A bug that changes while the pages are
+            being read moves to the end and shifts the pages after it, so if
+            one comes back twice the search is run again.
+
+            :returns: A list of the bugs that are new or changed
+        """
+        if self.last_change_time:
+            search.changed_since(self.last_change_time)
+        if 'last_change_time' not in search._includefields:
+            search.include_fields('last_change_time')
+        search._order = 'changeddate,bug_id'
+        while True:
+            bugs = OrderedDict()
+            for bug in search.iter_search():
+                if bug.id in bugs:
+                    break
+                bugs[bug.id] = bug
+            else:
+                return self.advance(bugs.values())
+
+    def advance(self, bugs):
+        """
+            Drop the bugs this cursor has already returned and move it past
+            the rest. Useful with bugs found some other way, like
+            iter_search().
+
+            :returns: A list of the bugs that are new or changed
+        """
+        new = []
+        for bug in bugs:
+            changed = bug.last_change_time
+            if changed == self.last_change_time and bug.id in self.seen_ids:
+                continue
+            new.append(bug)
+            if changed is None:
+                continue
+            if self.last_change_time is None or changed > self.last_change_time:
+                self.last_change_time = changed
+                self.seen_ids = set([bug.id])
+            elif changed == self.last_change_time:
+                self.seen_ids.add(bug.id)
+        return new
+
+    def to_dict(self):
+        return {'last_change_time': self.last_change_time,
+                'seen_ids': sorted(self.seen_ids)}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('last_change_time'), data.get('seen_ids', ()))
+
+    def to_json(self):
+        """
+            Return the cursor as a JSON string that can be stored between
+            runs and passed to from_json()
+        """
+        return json.dumps(self.to_dict())
 
-            return [Bug(self._bugsy, **bug) for bug in results['bugs']]
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_dict(json.loads(data))
@@ -16,4 +16,5 @@ setup(name='bugsy',
                   'Programming Language :: Python'],
         packages = find_packages(),
         install_requires=['requests>=1.1.0'],
+        extras_require={'async': ['aiohttp']},
         )
@@ -1,5 +1,22 @@
+import sys
+
 import pytest
 
+from bugsy import RetryPolicy
+
+# AsyncBugsy and its tests use syntax that only exists on Python 3.6+
+collect_ignore = []
+if sys.version_info < (3, 6):
+    collect_ignore.append('test_aio.py')
+
+
+@pytest.fixture(autouse=True)
+def no_waiting_between_retries(monkeypatch):
+    # Requests are still retried as the policy says, just without the
+    # backoff making every test of a server error take seconds
+    monkeypatch.setattr(RetryPolicy, 'sleep',
+                        lambda self, attempt, response=None: None)
+
 
 @pytest.fixture(scope="module")
 def bug_return():
@@ -0,0 +1,232 @@
+import asyncio
+
+import pytest
+
+from bugsy import AsyncBugsy, Bug, RetryPolicy
+from bugsy.errors import BugsyException, SearchException
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+
+def run(test, routes, **kwargs):
+    """
+        Serve routes, a dict of (method, path) to the (status, body) answers
+        given in turn, the last one repeating, and return what awaiting
+        test(bugzilla) gave with an AsyncBugsy talking to that server, plus
+        the (method, path, query, headers, body) of every request it made.
+    """
+    seen = []
+    answers = dict((key, list(value)) for key, value in routes.items())
+
+    async def handle(request):
+        seen.append((request.method, request.path, request.query,
+                     request.headers, await request.text()))
+        pending = answers[(request.method, request.path)]
+        status, body = pending.pop(0) if len(pending) > 1 else pending[0]
+        if isinstance(body, str):
+            return web.Response(text=body, status=status)
+        return web.json_response(body, status=status)
+
+    return serve(test, handle, '*', '/rest/{path:.*}', **kwargs), seen
+
+
+def serve(test, handle, method, path, **kwargs):
+    async def main():
+        app = web.Application()
+        app.router.add_route(method, path, handle)
+        async with TestServer(app) as server:
+            url = str(server.make_url('/rest'))
+            async with AsyncBugsy(bugzilla_url=url, **kwargs) as bugzilla:
+                return await test(bugzilla)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_we_can_get_a_bug(bug_return):
+    bug, seen = run(lambda bugzilla: bugzilla.get(1017315),
+                    {('GET', '/rest/bug/1017315'): [(200, bug_return)]})
+    assert bug.id == 1017315
+    assert bug.summary == 'Schedule Mn tests on opt Linux builds on cedar'
+    assert 'summary' in seen[0][2].getall('include_fields')
+    assert seen[0][3]['User-Agent'] == 'Bugsy'
+
+
+def test_we_never_send_more_requests_at_once_than_allowed():
+    in_flight = []
+    most = []
+
+    async def handle(request):
+        in_flight.append(request)
+        most.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.remove(request)
+        return web.json_response({'bugs': [{'id': int(request.match_info['id'])}]})
+
+    def get_all(bugzilla):
+        return asyncio.gather(*[bugzilla.get(i) for i in range(1, 6)])
+
+    bugs = serve(get_all, handle, 'GET', '/rest/bug/{id}', max_concurrency=2)
+    assert [bug.id for bug in bugs] == [1, 2, 3, 4, 5]
+    assert max(most) == 2
+
+
+def test_we_authenticate_like_bugsy(bug_return):
+    async def get(bugzilla):
+        assert bugzilla.authenticated
+        return await bugzilla.get(1017315)
+
+    _, seen = run(get, {('GET', '/rest/bug/1017315'): [(200, bug_return)]},
+                  userid='1234', cookie='abcd', username='foo')
+    assert seen[0][3]['X-Bugzilla-Token'] == '1234-abcd'
+
+
+def test_we_can_search_and_get_comments(comments_return):
+    async def search(bugzilla):
+        bugs = await bugzilla.search_for.keywords('checkin-needed').search()
+        return await bugzilla.comments_of(bugs[0])
+
+    comments, seen = run(search, {
+        ('GET', '/rest/bug'): [(200, {'bugs': [{'id': 1017315}]})],
+        ('GET', '/rest/bug/1017315/comment'): [(200, comments_return)],
+    })
+    assert [comment.text for comment in comments] == ['text 1', 'text 2']
+    assert seen[0][2]['keywords'] == 'checkin-needed'
+
+
+def test_errors_are_raised_when_awaited():
+    with pytest.raises(BugsyException) as e:
+        run(lambda bugzilla: bugzilla.get(1017315),
+            {('GET', '/rest/bug/1017315'): [(500, "It's all broken")]},
+            retry=False)
+    assert "It's all broken" in str(e.value)
+
+
+def test_search_errors_are_search_exceptions():
+    with pytest.raises(SearchException):
+        run(lambda bugzilla: bugzilla.search_for.product('Firefox').search(),
+            {('GET', '/rest/bug'): [(400, {'error': True, 'code': 108,
+                                           'message': 'Bad product'})]})
+
+
+def test_transient_errors_are_retried(bug_return):
+    policy = RetryPolicy(backoff_factor=0)
+    answers = [(503, 'Try again'), (200, bug_return)]
+    bug, seen = run(lambda bugzilla: bugzilla.get(1017315),
+                    {('GET', '/rest/bug/1017315'): answers}, retry=policy)
+    assert bug.id == 1017315
+    assert len(seen) == 2
+    assert policy.counters['retries'] == 1
+
+
+def test_every_search_method_is_awaitable():
+    async def everything(bugzilla):
+        count = await bugzilla.search_for.product('Firefox').count()
+        ids = await bugzilla.search_for.product('Firefox').ids()
+        seen = []
+        async for bug in bugzilla.search_for.product('Firefox').iter_search(page_size=1):
+            seen.append(bug.id)
+        return count, ids, seen
+
+    result, seen = run(everything, {('GET', '/rest/bug'): [
+        (200, {'bug_count': 2}),
+        (200, {'bugs': [{'id': 1}, {'id': 2}]}),
+        (200, {'bugs': [{'id': 1}]}),
+        (200, {'bugs': []}),
+    ]})
+    assert result == (2, [1, 2], [1])
+    assert seen[0][2]['count_only'] == '1'
+    assert seen[1][2]['include_fields'] == 'id'
+    assert [(query['limit'], query['offset']) for _, _, query, _, _ in seen[2:]] == \
+        [('1', '0'), ('1', '1')]
+
+
+def test_bug_number_searches_are_sent_at_once():
+    def search(bugzilla):
+        return bugzilla.search_for.bug_number([1, 2, 3], chunk_size=2).search()
+
+    bugs, seen = run(search, {('GET', '/rest/bug'): [
+        (200, {'bugs': [{'id': 1}, {'id': 2}]}),
+        (200, {'bugs': []}),
+    ]})
+    assert [bug.id for bug in bugs] == [1, 2]
+    assert sorted(query['id'] for _, _, query, _, _ in seen) == ['1,2', '3']
+
+
+def test_we_can_shard_a_search():
+    def search(bugzilla):
+        return bugzilla.search_for.timeframe('2015-01-01', '2015-01-03')\
+                                  .sharded_search(shards=2, limit=10)
+
+    bugs, seen = run(search, {('GET', '/rest/bug'): [
+        (200, {'bugs': [{'id': 2}]}),
+        (200, {'bugs': [{'id': 1}]}),
+    ]})
+    assert [bug.id for bug in bugs] == [1, 2]
+    assert sorted(query['chfieldfrom'] for _, _, query, _, _ in seen) == \
+        ['2015-01-01 00:00:00', '2015-01-02 00:00:00']
+
+
+def test_we_can_get_comments_for_many_bugs(comments_return):
+    comments, seen = run(
+        lambda bugzilla: bugzilla.get_comments([1017315, 1]),
+        {('GET', '/rest/bug/1017315/comment'): [
+            (200, {'bugs': {'1017315': comments_return['bugs']['1017315'],
+                            '1': {'comments': []}}})]})
+    assert [c.text for c in comments[1017315]] == ['text 1', 'text 2']
+    assert comments[1] == []
+    assert seen[0][2]['ids'] == '1'
+
+
+def test_we_can_put_a_bug_without_refetching():
+    async def put(bugzilla):
+        bug = Bug(bugzilla.bugsy, id=1017315, status='NEW')
+        bug.status = 'RESOLVED'
+        bug.resolution = 'FIXED'
+        return await bugzilla.put(bug, refetch=False)
+
+    bug, seen = run(put, {('PUT', '/rest/bug/1017315'): [
+        (200, {'bugs': [{'id': 1017315, 'changes': {}}]})]}, api_key='key')
+    assert len(seen) == 1
+    assert seen[0][3]['X-Bugzilla-API-Key'] == 'key'
+    assert '"RESOLVED"' in seen[0][4]
+    assert bug.diff() == {}
+
+
+def test_we_refetch_only_the_fields_asked_for():
+    async def put(bugzilla):
+        bug = Bug(bugzilla.bugsy, id=1017315, status='NEW')
+        bug.status = 'RESOLVED'
+        return await bugzilla.put(bug, include_fields='status')
+
+    bug, seen = run(put, {
+        ('PUT', '/rest/bug/1017315'): [(200, {'bugs': [{'id': 1017315}]})],
+        ('GET', '/rest/bug/1017315'): [(200, {'bugs': [{'id': 1017315,
+                                                        'status': 'RESOLVED'}]})],
+    }, api_key='key')
+    assert bug.status == 'RESOLVED'
+    assert seen[1][2]['include_fields'] == 'status'
+
+
+def test_attachment_data_is_downloaded_without_blocking(attachment_return):
+    async def attachments(bugzilla):
+        bug = Bug(bugzilla.bugsy, id=1017315)
+        found = await bugzilla.get_attachments(bug)
+        await bugzilla.attachment_data(found[0])
+        return found[0]
+
+    listed = dict(attachment_return['bugs']['1017315'][0])
+    del listed['data']
+    attachment, seen = run(attachments, {
+        ('GET', '/rest/bug/1017315/attachment'): [(200, {'bugs': {'1017315': [listed]}})],
+        ('GET', '/rest/bug/attachment/8842942'): [
+            (200, {'attachments': {'8842942': {'data': 'aGVsbG8='}}})],
+    })
+    assert attachment.data == 'aGVsbG8='
+    assert seen[0][2]['exclude_fields'] == 'data'
+    assert seen[1][2]['include_fields'] == 'data'
@@ -1,10 +1,12 @@
+import base64
 import copy
 import datetime
+import io
 import json
 
 import responses
 
-from bugsy import Bugsy, Attachment, AttachmentException
+from bugsy import Bugsy, Attachment, AttachmentException, BugsyException
 
 
 def test_init(attachment_return):
@@ -55,6 +57,21 @@ def test_setter_validate_base64_types(attachment_return):
         assert str(e) == "Message: The data field value must be in base64 format Code: None"
 
 
+def test_setter_validates_base64_without_decoding(attachment_return):
+    attachment = Attachment(Bugsy(), **attachment_return['bugs']['1017315'][0])
+
+    attachment.data = 'Rm9v\nYmFy\n'
+    assert attachment.data == 'Rm9v\nYmFy\n'
+    attachment.data = 'Rm8='
+
+    for value in ['Rm9vYmF', 'Rm9v YmF*', 'R===']:
+        try:
+            attachment.data = value
+            assert False, "Should have rejected %r" % value
+        except AttachmentException as e:
+            assert str(e) == "Message: The data field value must be in base64 format Code: None"
+
+
 def test_setter_validate_string_types(attachment_return):
     bugzilla = Bugsy()
     source = attachment_return['bugs']['1017315'][0]
@@ -150,3 +167,103 @@ def test_update_without_an_id_fails(attachment_return):
         assert False, "Should have raised an AttachmentException due to update without id"
     except AttachmentException as e:
         assert str(e) == "Message: Cannot update bug without an attachment id Code: None"
+
+
+def test_times_are_only_parsed_when_asked_for(attachment_return):
+    bugzilla = Bugsy()
+    source = attachment_return['bugs']['1017315'][0]
+    attachment = Attachment(bugzilla, **source)
+
+    assert attachment._attachment['creation_time'] == source['creation_time']
+    assert attachment.creation_time == datetime.datetime(2017, 3, 2, 17, 21, 23)
+    assert attachment._attachment['creation_time'] is attachment.creation_time
+
+
+@responses.activate
+def test_data_is_downloaded_when_first_used(attachment_return, tmpdir):
+    source = copy.deepcopy(attachment_return['bugs']['1017315'][0])
+    del source['data']
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug/attachment/8842942?include_fields=data',
+                  body=json.dumps({"attachments": {"8842942": {"data": "Rm9vYmFy"}}, "bugs": {}}),
+                  status=200, content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    attachment = Attachment(bugzilla, **source)
+    assert len(responses.calls) == 0
+    assert attachment.data == 'Rm9vYmFy'
+    assert attachment.data == 'Rm9vYmFy'
+    assert len(responses.calls) == 1
+
+    path = tmpdir.join('attachment.txt')
+    attachment.save_to(str(path))
+    assert path.read_binary() == b'Foobar'
+    assert len(responses.calls) == 1
+
+
+def test_new_attachments_have_no_data_to_download():
+    attachment = Attachment(Bugsy())
+    assert attachment.data is None
+
+
+@responses.activate
+def test_data_is_streamed_and_decoded_in_chunks(attachment_return):
+    source = copy.deepcopy(attachment_return['bugs']['1017315'][0])
+    del source['data']
+    content = b'All work and no play makes Jack a dull boy?>' * 20
+    # Break the base64 into 76 character lines like encodebytes() does
+    flat = base64.b64encode(content).decode('ascii')
+    lines = [flat[i:i + 76] for i in range(0, len(flat), 76)]
+    encoded = json.dumps('\n'.join(lines) + '\n')
+    body = '{"attachments": {"8842942": {"data": %s}}, "bugs": {}}' % encoded.replace('/', '\\/')
+    assert '\\n' in body and '\\/' in body
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug/attachment/8842942?include_fields=data',
+                  body=body, status=200, content_type='application/json',
+                  match_querystring=True)
+    attachment = Attachment(Bugsy(), **source)
+    chunks = list(attachment.iter_bytes(chunk_size=7))
+    assert b''.join(chunks) == content
+    assert max(len(chunk) for chunk in chunks) <= 12
+    assert 'data' not in attachment.to_dict()
+
+    output = io.BytesIO()
+    attachment.save_to(output)
+    assert output.getvalue() == content
+
+
+@responses.activate
+def test_errors_are_raised_when_streaming_data(attachment_return):
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug/attachment/8842942?include_fields=data',
+                  body='{"error": true, "code": 304, "message": "Sorry, you are not authorized."}',
+                  status=200, content_type='application/json', match_querystring=True)
+    attachment = Attachment(Bugsy(), id=8842942)
+    try:
+        list(attachment.iter_bytes())
+        assert False, "Should have raised a BugsyException"
+    except BugsyException as e:
+        assert str(e) == "Message: Sorry, you are not authorized. Code: 304"
+
+
+@responses.activate
+def test_streamed_responses_that_are_retried_are_closed():
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug/attachment/8842942?include_fields=data',
+                  body='Service Unavailable', status=503, match_querystring=True)
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug/attachment/8842942?include_fields=data',
+                  body='{"attachments": {"8842942": {"data": "aGVsbG8="}}}', status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    sent = []
+    send = bugzilla._send
+
+    def record(*args, **kwargs):
+        sent.append(send(*args, **kwargs))
+        return sent[-1]
+
+    bugzilla._send = record
+    attachment = Attachment(bugzilla, id=8842942)
+    assert b''.join(attachment.iter_bytes()) == b'hello'
+    assert [response.status_code for response in sent] == [503, 200]
+    assert sent[0].raw.closed
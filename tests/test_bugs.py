@@ -1,11 +1,16 @@
+import base64
 import copy
 import datetime
+import io
 import json
 
 import responses
+from six.moves.urllib import parse
 
-from bugsy import Bugsy, Bug, Attachment
+from bugsy import Bugsy, Bug, Attachment, Comment
+from bugsy.dates import str2datetime
 from bugsy.errors import (BugsyException, BugException)
+from bugsy.retry import RetryPolicy
 from . import rest_url
 
 
@@ -450,7 +455,7 @@ def test_attachment_retrieval(attachment_return, bug_return):
     responses.add(responses.GET, rest_url('bug', 1017315),
                   json=bug_return, status=200,
                   content_type='application/json', match_querystring=True)
-    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/attachment',
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/attachment?exclude_fields=data',
                   json=attachment_return, status=200,
                   content_type='application/json', match_querystring=True)
 
@@ -519,3 +524,262 @@ def test_we_cant_add_attachment_without_id(attachment_return):
         bug.add_attachment(attachment)
     except BugException as e:
         assert str(e) == "Message: Cannot add an attachment without a bug id Code: None"
+
+def test_changing_a_bug_does_not_change_the_data_it_was_made_from(bug_return):
+    data = copy.deepcopy(bug_return['bugs'][0])
+    bug = Bug(**data)
+    bug.keywords.append('intermittent')
+    bug.assigned_to_detail['email'] = 'foo@bar.com'
+    bug.to_dict()['blocks'].append(1)
+    assert data == bug_return['bugs'][0]
+    assert bug.diff() == {
+        'keywords': {'add': ['intermittent']},
+        'assigned_to_detail': {
+            u'id': 347295,
+            u'email': u'foo@bar.com',
+            u'name': u'jgriffin@mozilla.com',
+            u'real_name': u'Jonathan Griffin (:jgriffin)'
+        },
+        'blocks': {'add': [1]},
+    }
+
+def test_unchanged_bug_has_an_empty_diff_after_reading_fields(bug_return):
+    bug = Bug(**bug_return['bugs'][0])
+    assert bug.flags == []
+    assert bug.cc == [u'coop@mozilla.com', u'dburns@mozilla.com',
+                      u'jlund@mozilla.com', u'mdas@mozilla.com']
+    assert bug.diff() == {}
+
+def test_comment_times_are_only_parsed_when_asked_for(comments_return):
+    source = comments_return['bugs']['1017315']['comments'][0]
+    comment = Comment(**source)
+    assert comment._comment['time'] == source['time']
+    assert comment.time == datetime.datetime(2014, 3, 27, 23, 47, 45)
+    assert comment.creation_time is comment.creation_time
+
+def test_bugzilla_times_are_parsed_quickly_and_strictly():
+    assert str2datetime('2014-05-28T23:57:58Z') == datetime.datetime(2014, 5, 28, 23, 57, 58)
+    for value in ['2014-05-28 23:57:58', '2014-05-2 T00:00:00Z',
+                  '2014-05-+1T00:00:00Z', '2014-05-28T23-57-58Z',
+                  '2014/05/28T23:57:58Z', '2014-13-28T23:57:58Z']:
+        try:
+            str2datetime(value)
+            assert False, "Should have raised a ValueError for %r" % value
+        except ValueError:
+            pass
+
+@responses.activate
+def test_we_can_get_only_new_comments(comments_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/comment?new_since=2014-03-27T23%3A50%3A00Z',
+                    body=json.dumps(comments_return), status=200,
+                    content_type='application/json', match_querystring=True)
+    bug = Bug(Bugsy(), id=1017315)
+    comments = bug.get_comments(new_since=datetime.datetime(2014, 3, 27, 23, 50))
+    assert len(comments) == 2
+
+@responses.activate
+def test_we_can_sync_comments(comments_return):
+    comments = comments_return['bugs']['1017315']['comments']
+    posted = comments[:1]
+    asked = []
+
+    def callback(request):
+        # Bugzilla only returns comments strictly newer than new_since
+        query = dict(parse.parse_qsl(parse.urlsplit(request.url).query))
+        asked.append(query.get('new_since'))
+        since = str2datetime(query['new_since']) if 'new_since' in query else None
+        found = [c for c in posted
+                 if since is None or str2datetime(c['creation_time']) > since]
+        return (200, {}, json.dumps({'bugs': {'1017315': {'comments': found}}}))
+
+    responses.add_callback(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/comment',
+                           callback=callback, content_type='application/json')
+
+    bug = Bug(Bugsy(), id=1017315)
+    assert [c.id for c in bug.sync_comments()] == [8589785]
+    # Posted later in the same second as the newest comment we have
+    same_second = dict(comments[1], id=8589786,
+                       creation_time=comments[0]['creation_time'])
+    posted.extend([same_second, comments[1]])
+    assert [c.id for c in bug.sync_comments()] == [8589785, 8589786, 8589812]
+    assert [c.id for c in bug.sync_comments()] == [8589785, 8589786, 8589812]
+    assert asked == [None, '2014-03-27T23:47:44Z', '2014-03-27T23:56:33Z']
+    assert bug.diff() == {}
+
+def _attachment_upload(bugzilla, bug_return, posted):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  json=bug_return, status=200,
+                  content_type='application/json', match_querystring=True)
+
+    def callback(request):
+        body = request.body
+        if not isinstance(body, bytes):
+            body = b''.join(body)
+        # Bugzilla may read exactly Content-Length bytes of the body
+        assert 'Transfer-Encoding' not in request.headers
+        assert int(request.headers['Content-Length']) == len(body)
+        posted.append(json.loads(body.decode('utf-8')))
+        return (200, {}, json.dumps({'ids': [12345]}))
+
+    responses.add_callback(responses.POST,
+                           'https://bugzilla.mozilla.org/rest/bug/1017315/attachment',
+                           callback=callback, content_type='application/json')
+    return bugzilla.get(1017315)
+
+@responses.activate
+def test_add_attachment_from_file_path(bug_return, tmp_path):
+    content = bytes(bytearray(range(256))) * 41
+    path = tmp_path / 'crash.dmp'
+    path.write_bytes(content)
+    posted = []
+    bug = _attachment_upload(Bugsy(), bug_return, posted)
+
+    bug.add_attachment_from_file(str(path), content_type='application/octet-stream',
+                                 comment='Minidump', chunk_size=1000)
+
+    assert len(posted) == 1
+    assert posted[0]['ids'] == [1017315]
+    assert posted[0]['file_name'] == 'crash.dmp'
+    assert posted[0]['summary'] == 'crash.dmp'
+    assert posted[0]['comment'] == 'Minidump'
+    assert base64.b64decode(posted[0]['data']) == content
+
+@responses.activate
+def test_add_attachment_from_file_object(bug_return):
+    posted = []
+    bug = _attachment_upload(Bugsy(), bug_return, posted)
+
+    bug.add_attachment_from_file(io.BytesIO(b'hello world'), file_name='hello.txt',
+                                 summary='Greeting', content_type='text/plain',
+                                 chunk_size=4)
+
+    assert posted[0]['file_name'] == 'hello.txt'
+    assert posted[0]['summary'] == 'Greeting'
+    assert base64.b64decode(posted[0]['data']) == b'hello world'
+
+@responses.activate
+def test_add_attachment_from_empty_file(bug_return, tmp_path):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    posted = []
+    bug = _attachment_upload(Bugsy(), bug_return, posted)
+
+    bug.add_attachment_from_file(str(path), content_type='text/plain')
+
+    assert posted[0]['data'] == ''
+
+@responses.activate
+def test_retried_attachment_uploads_send_the_whole_file_again(bug_return, tmp_path):
+    content = b'minidump' * 100
+    path = tmp_path / 'crash.dmp'
+    path.write_bytes(content)
+    fileobj = io.BytesIO(b'skip' + content)
+    fileobj.read(4)
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  json=bug_return, status=200,
+                  content_type='application/json', match_querystring=True)
+    posted = []
+
+    def callback(request):
+        body = request.body
+        if not isinstance(body, bytes):
+            body = b''.join(body)
+        posted.append(json.loads(body.decode('utf-8')))
+        # Fail the first attempt of every upload
+        if len(posted) % 2:
+            return (503, {}, 'Service Unavailable')
+        return (200, {}, json.dumps({'ids': [12345]}))
+
+    responses.add_callback(responses.POST,
+                           'https://bugzilla.mozilla.org/rest/bug/1017315/attachment',
+                           callback=callback, content_type='application/json')
+    bugzilla = Bugsy(retry=RetryPolicy(retry_non_idempotent=True, backoff_factor=0))
+    bug = bugzilla.get(1017315)
+
+    for source in [str(path), fileobj]:
+        bug.add_attachment_from_file(source, file_name='crash.dmp', chunk_size=64,
+                                     content_type='application/octet-stream')
+
+    assert len(posted) == 4
+    for body in posted:
+        assert base64.b64decode(body['data']) == content
+
+def test_add_attachment_from_file_needs_required_fields():
+    bug = Bug(id=1017315)
+    try:
+        bug.add_attachment_from_file(io.BytesIO(b'hello'), file_name='hello.txt')
+        assert False, "Should have raised a BugException due to missing content_type"
+    except BugException as e:
+        assert str(e) == "Message: Cannot add attachment without all required fields Code: None"
+
+    try:
+        bug.add_attachment_from_file(io.BytesIO(b'hello'), file_name='hello.txt',
+                                     content_type='text/plain', colour='red')
+        assert False, "Should have raised a BugException due to an unknown field"
+    except BugException as e:
+        assert str(e) == "Message: Unknown attachment fields: colour Code: None"
+
+def test_diff_only_looks_at_changed_fields(bug_return):
+    bug = Bug(**bug_return['bugs'][0])
+    assert bug.diff() == {}
+
+    assert 'dburns@mozilla.com' in bug.cc
+    len(bug.keywords)
+    assert bug._dirty == set()
+
+    bug.summary = 'Something new'
+    assert bug._dirty == set(['summary'])
+    assert bug.diff() == {'summary': 'Something new'}
+
+def test_list_fields_changed_in_place_are_diffed(bug_return):
+    bug = Bug(**bug_return['bugs'][0])
+    bug.cc.append('foo@example.com')
+    bug.keywords += ['intermittent']
+    bug.blocks.insert(0, 1)
+    bug.see_also.extend(['https://example.com/'])
+    bug.cc.remove('dburns@mozilla.com')
+
+    assert bug.diff() == {
+        'cc': {'add': ['foo@example.com'], 'remove': ['dburns@mozilla.com']},
+        'keywords': {'add': ['intermittent']},
+        'blocks': {'add': [1]},
+        'see_also': {'add': ['https://example.com/']},
+    }
+
+def test_copies_of_observed_lists_are_plain_lists(bug_return):
+    import pickle
+    bug = Bug(**bug_return['bugs'][0])
+    for copied in (copy.copy(bug.cc), copy.deepcopy(bug.cc),
+                   pickle.loads(pickle.dumps(bug.cc))):
+        assert type(copied) is list
+        assert copied == bug.cc
+
+def test_flags_and_new_bug_defaults_are_diffed(bug_return):
+    bug = Bug(**bug_return['bugs'][0])
+    bug.flags.append({'name': 'needinfo', 'status': '?'})
+    assert bug.diff() == {'flags': [{'name': 'needinfo', 'status': '?'}]}
+
+    bug = Bug()
+    bug.summary = 'New bug'
+    assert bug.diff() == {'summary': 'New bug', 'op_sys': 'All',
+                          'product': 'core', 'component': 'general',
+                          'platform': 'All', 'version': 'unspecified'}
+
+def test_defaults_are_only_set_on_new_bugs():
+    bug = Bug(id=1017315, summary='Fetched')
+    assert bug.product is None
+    assert bug.diff() == {}
+
+    bug = Bug(summary='New')
+    assert bug.product == 'core'
+
+def test_we_know_which_fields_were_fetched(bug_return):
+    bug = Bug(id=1017315, summary='Fetched', assigned_to=None, cc_detail=[])
+    assert bug.was_fetched('summary')
+    assert bug.was_fetched('assigned_to') and bug.assigned_to is None
+    assert bug.was_fetched('cc') and bug.cc == []
+    assert not bug.was_fetched('whiteboard') and bug.whiteboard is None
+    assert not bug.was_fetched('keywords') and bug.keywords == []
+    bug.keywords.append('regression')
+    assert bug.diff() == {'keywords': {'add': ['regression']}}
+    assert not Bug(summary='New').was_fetched('summary')
@@ -1,3 +1,5 @@
+import copy
+import datetime
 import json
 
 import responses
@@ -223,3 +225,305 @@ def test_we_can_know_when_bugsy_is_authenticated_using_apikey():
                   match_querystring=True)
     bugzilla = Bugsy(username='foo', api_key='goodkey')
     assert bugzilla.authenticated
+
+@responses.activate
+def test_we_can_get_many_bugs_at_once():
+    for bug_id in [1, 2, 3]:
+        responses.add(responses.GET, rest_url('bug', bug_id),
+                      body=json.dumps({"bugs": [{"id": bug_id}]}), status=200,
+                      content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    bugs = bugzilla.get_many([3, 1, 2], max_workers=2)
+    assert list(bugs.keys()) == [3, 1, 2]
+    assert bugs[1].id == 1
+    assert bugs.errors == {}
+
+@responses.activate
+def test_errors_are_collected_when_getting_many_bugs():
+    error_response = {
+        "code" : 101,
+        "error" : True,
+        "message" : "Bug 111111111 does not exist."
+    }
+    responses.add(responses.GET, rest_url('bug', 1),
+                  body=json.dumps({"bugs": [{"id": 1}]}), status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', 111111111),
+                  body=json.dumps(error_response), status=404,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    bugs = bugzilla.get_many([111111111, 1])
+    assert list(bugs.keys()) == [1]
+    assert isinstance(bugs.errors[111111111], BugsyException)
+    assert bugs.errors[111111111].code == 101
+
+@responses.activate
+def test_we_can_get_comments_and_attachments_for_many_bugs(comments_return, attachment_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/comment',
+                  body=json.dumps(comments_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/attachment?exclude_fields=data',
+                  body=json.dumps(attachment_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    bugs = [Bug(bugzilla, id=1017315)]
+    comments = bugzilla.comments_for(bugs)
+    attachments = bugzilla.attachments_for(bugs)
+    assert [comment.id for comment in comments[1017315]] == [8589785, 8589812]
+    assert attachments[1017315][0].id == 8842942
+
+def test_we_can_configure_the_connection_pool():
+    bugzilla = Bugsy(pool_connections=2, pool_maxsize=25, pool_block=True)
+    adapter = bugzilla.session.get_adapter('https://bugzilla.mozilla.org/rest')
+    assert adapter._pool_connections == 2
+    assert adapter._pool_maxsize == 25
+    assert adapter._pool_block
+    assert bugzilla.thread_pool._processes == 25
+
+def test_close_stops_the_thread_pool():
+    import requests
+
+    class Session(requests.Session):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    session = Session()
+    with Bugsy(session=session) as bugzilla:
+        pool = bugzilla.thread_pool
+        workers = list(pool._pool)
+        assert all(worker.is_alive() for worker in workers)
+    assert not any(worker.is_alive() for worker in workers)
+    assert bugzilla._thread_pool is None
+    # A session that was passed in is left open for its owner
+    assert not session.closed
+
+def test_we_can_share_an_adapter_between_instances():
+    import requests
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=30)
+    first = Bugsy(adapter=adapter)
+    second = Bugsy(adapter=adapter)
+    url = 'https://bugzilla.mozilla.org/rest'
+    assert first.session is not second.session
+    assert first.session.get_adapter(url) is second.session.get_adapter(url)
+
+@responses.activate
+def test_we_pass_the_timeout_to_requests(bug_return):
+    import requests
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    session = requests.Session()
+    bugzilla = Bugsy(session=session, timeout=(3, 30))
+    bugzilla.get(1017315)
+    assert bugzilla.session is session
+    assert responses.calls[0].request.req_kwargs['timeout'] == (3, 30)
+
+@responses.activate
+def test_we_can_get_comments_for_many_bugs_in_one_request(comments_return):
+    comments = comments_return['bugs']['1017315']
+    body = {"bugs": {"1017315": comments, "1017316": {"comments": []}}, "comments": {}}
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315/comment?ids=1017316',
+                  body=json.dumps(body), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    result = bugzilla.get_comments([1017315, 1017316])
+    assert len(responses.calls) == 1
+    assert [comment.id for comment in result[1017315]] == [8589785, 8589812]
+    assert result[1017316] == []
+
+@responses.activate
+def test_we_get_comments_in_chunks_and_only_new_ones(comments_return):
+    comments = comments_return['bugs']['1017315']
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/comment?ids=2&new_since=2014-03-27T00%3A00%3A00Z',
+                  body=json.dumps({"bugs": {"1": comments, "2": {"comments": []}}}), status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/3/comment?new_since=2014-03-27T00%3A00%3A00Z',
+                  body='{"code": 101, "error": true, "message": "Bug #3 does not exist."}', status=404,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    result = bugzilla.get_comments([1, 2, 3], chunk_size=2,
+                                   new_since=datetime.datetime(2014, 3, 27))
+    assert list(result.keys()) == [1, 2]
+    assert str(result.errors[3]) == "Message: Bug #3 does not exist. Code: 101"
+
+def _bug_data(bug_return, bug_id, **fields):
+    data = copy.deepcopy(bug_return['bugs'][0])
+    data.update(fields, id=bug_id)
+    return data
+
+@responses.activate
+def test_put_many_groups_identical_changes(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    puts = []
+
+    def put_callback(request):
+        puts.append((request.url, json.loads(request.body)))
+        return (200, {}, json.dumps({'bugs': []}))
+
+    for bug_id in (1, 3):
+        responses.add_callback(responses.PUT,
+                               'https://bugzilla.mozilla.org/rest/bug/%s' % bug_id,
+                               callback=put_callback,
+                               content_type='application/json')
+    responses.add(responses.GET, rest_url('bug', id='1,2,3'),
+                  json={'bugs': [_bug_data(bug_return, i, status='RESOLVED')
+                                 for i in (3, 2, 1)]},
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+
+    bugzilla = Bugsy("foo", "bar")
+    bugs = [Bug(bugzilla, **_bug_data(bug_return, i, status='NEW', resolution=''))
+            for i in (1, 2, 3, 4)]
+    for bug in bugs[:2]:
+        bug.status = 'RESOLVED'
+        bug.resolution = 'FIXED'
+    bugs[2].summary = 'Something else'
+
+    result = bugzilla.put_many(bugs)
+
+    assert sorted(puts) == [
+        ('https://bugzilla.mozilla.org/rest/bug/1',
+         {'ids': [1, 2], 'resolution': 'FIXED', 'status': 'RESOLVED'}),
+        ('https://bugzilla.mozilla.org/rest/bug/3',
+         {'ids': [3], 'summary': 'Something else'}),
+    ]
+    assert list(result.keys()) == [1, 2, 3, 4]
+    assert result[2].status == 'RESOLVED'
+    # Bug 4 had no changes so it was neither sent nor fetched again
+    assert result[4] is bugs[3]
+    assert not result.errors
+    assert len(responses.calls) == 4
+
+@responses.activate
+def test_put_many_refetches_the_fields_asked_for(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1',
+                  json={'bugs': []}, status=200,
+                  content_type='application/json')
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug?id=1'
+                  '&include_fields=id&include_fields=status',
+                  json={'bugs': [{'id': 1, 'status': 'RESOLVED'}]},
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+
+    bugzilla = Bugsy("foo", "bar")
+    bug = Bug(bugzilla, **_bug_data(bug_return, 1, status='NEW'))
+    bug.status = 'RESOLVED'
+
+    result = bugzilla.put_many([bug], include_fields=['status'])
+
+    assert result[1].status == 'RESOLVED'
+    assert result[1].summary is None
+
+    # A single field can be given as a string like put() allows
+    bug.status = 'VERIFIED'
+    result = bugzilla.put_many([bug], include_fields='status')
+    assert result[1].status == 'RESOLVED'
+
+@responses.activate
+def test_put_many_records_errors_for_failed_groups(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1',
+                  body='{"error":true,"code":109,"message":"Not allowed"}',
+                  status=400, content_type='application/json')
+    responses.add(responses.GET, rest_url('bug', id='2'),
+                  json={'bugs': [_bug_data(bug_return, 2)]}, status=200,
+                  content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy("foo", "bar")
+    bugs = [Bug(bugzilla, **_bug_data(bug_return, i)) for i in (1, 2)]
+    bugs[0].summary = 'Forbidden'
+
+    result = bugzilla.put_many(bugs)
+
+    assert list(result.keys()) == [2]
+    assert str(result.errors[1]) == "Message: Not allowed Code: 109"
+
+def test_put_many_needs_credentials_and_bug_ids():
+    try:
+        Bugsy().put_many([Bug(id=1)])
+        assert False, "Should have raised a BugsyException without credentials"
+    except BugsyException as e:
+        assert "without credentials" in str(e)
+
+    bugzilla = Bugsy()
+    bugzilla._have_auth = True
+    try:
+        bugzilla.put_many([Bug()])
+        assert False, "Should have raised a BugsyException for a bug without id"
+    except BugsyException as e:
+        assert "use put() to create them" in str(e)
+
+@responses.activate
+def test_put_without_refetch_applies_changes_locally(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  json={'bugs': [{'id': 1017315,
+                                  'last_change_time': '2016-01-01T10:00:00Z',
+                                  'changes': {'summary': {'added': 'I love foo',
+                                                          'removed': 'Old'}}}]},
+                  status=200, content_type='application/json')
+    bugzilla = Bugsy("foo", "bar")
+    bug = Bug(bugzilla, **copy.deepcopy(bug_return['bugs'][0]))
+    bug.summary = 'I love foo  '
+    bug.cc.append('foo@example.com')
+
+    updated = bugzilla.put(bug, refetch=False)
+
+    assert updated is bug
+    assert len(responses.calls) == 2
+    assert bug.summary == 'I love foo'
+    assert bug.last_change_time == '2016-01-01T10:00:00Z'
+    assert 'foo@example.com' in bug.cc
+    assert bug.diff() == {}
+
+@responses.activate
+def test_put_can_refetch_chosen_fields(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  json={'bugs': []}, status=200, content_type='application/json')
+    responses.add(responses.GET, rest_url('bug', 1017315,
+                                          include_fields=['id', 'summary', 'flags']),
+                  json=bug_return, status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy("foo", "bar")
+    bug = Bug(bugzilla, **copy.deepcopy(bug_return['bugs'][0]))
+    bug.summary = 'I love foo'
+
+    bugzilla.put(bug, include_fields=['id', 'summary', 'flags'])
+
+    assert len(responses.calls) == 3
+
+@responses.activate
+def test_put_many_without_refetch(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1',
+                  json={'bugs': [{'id': i, 'last_change_time': '2016-01-01T10:00:00Z',
+                                  'changes': {}} for i in (1, 2)]},
+                  status=200, content_type='application/json')
+    bugzilla = Bugsy("foo", "bar")
+    bugs = [Bug(bugzilla, **_bug_data(bug_return, i)) for i in (1, 2)]
+    for bug in bugs:
+        bug.summary = 'Same for both'
+
+    result = bugzilla.put_many(bugs, refetch=False)
+
+    assert len(responses.calls) == 2
+    assert result[1] is bugs[0] and result[2] is bugs[1]
+    assert all(bug.diff() == {} for bug in bugs)
+    assert bugs[1].last_change_time == '2016-01-01T10:00:00Z'
@@ -0,0 +1,181 @@
+import json
+import os
+
+import responses
+
+from bugsy import Bug, Bugsy, FileCache, MemoryCache
+from . import rest_url
+
+
+@responses.activate
+def test_fresh_responses_are_served_from_the_cache(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy(cache=MemoryCache(ttl=60))
+    first = bugzilla.get(1017315)
+    second = bugzilla.get(1017315)
+    assert len(responses.calls) == 1
+    assert first.summary == second.summary
+    assert first is not second
+
+
+@responses.activate
+def test_include_fields_are_part_of_the_cache_key(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', 1017315, include_fields='id'),
+                  body=json.dumps({"bugs": [{"id": 1017315}]}), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy(cache=MemoryCache())
+    bugzilla.get(1017315)
+    bug = bugzilla.get(1017315, include_fields='id')
+    assert len(responses.calls) == 2
+    assert bug.summary is None
+
+
+@responses.activate
+def test_stale_responses_are_revalidated(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True,
+                  headers={'ETag': '"abc"',
+                           'Last-Modified': 'Fri, 30 May 2014 21:20:17 GMT'})
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body='', status=304, match_querystring=True)
+    bugzilla = Bugsy(cache=MemoryCache(ttl=0))
+    bugzilla.get(1017315)
+    bug = bugzilla.get(1017315)
+    assert bug.id == 1017315
+    headers = responses.calls[1].request.headers
+    assert headers['If-None-Match'] == '"abc"'
+    assert headers['If-Modified-Since'] == 'Fri, 30 May 2014 21:20:17 GMT'
+
+
+@responses.activate
+def test_responses_do_not_leak_between_users(bug_return):
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json')
+    cache = MemoryCache()
+    Bugsy(api_key='first', cache=cache).get(1017315)
+    Bugsy(api_key='second', cache=cache).get(1017315)
+    Bugsy(api_key='first', cache=cache).get(1017315)
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_login_is_never_cached():
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    cache = MemoryCache()
+    Bugsy("foo", "bar", cache=cache)
+    Bugsy("foo", "bar", cache=cache)
+    assert len(responses.calls) == 2
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_bytes=10)
+    cache.set('a', {'size': 4})
+    cache.set('b', {'size': 4})
+    cache.get('a')
+    cache.set('c', {'size': 4})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+@responses.activate
+def test_file_cache_is_shared_between_instances(bug_return, tmpdir):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    directory = str(tmpdir.join('cache'))
+    Bugsy(cache=FileCache(directory)).get(1017315)
+    bug = Bugsy(cache=FileCache(directory)).get(1017315)
+    assert bug.id == 1017315
+    assert len(responses.calls) == 1
+
+
+def test_file_cache_evicts_by_size(tmpdir):
+    cache = FileCache(str(tmpdir), max_bytes=200)
+    for key in 'abcde':
+        cache.set(key, {'body': 'x' * 50, 'size': 50})
+    assert cache.get('a') is None
+    assert cache.get('e') is not None
+
+
+def test_file_cache_only_scans_the_directory_when_full(tmpdir, monkeypatch):
+    cache = FileCache(str(tmpdir), max_bytes=1000)
+    scans = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: scans.append(path) or listdir(path))
+    for key in 'abcde':
+        cache.set(key, {'body': 'x' * 50, 'size': 50})
+    assert len(scans) == 1
+    for key in 'fghijklmnopqrstuvwxyz':
+        cache.set(key, {'body': 'x' * 50, 'size': 50})
+    assert 1 < len(scans) < 10
+
+
+@responses.activate
+def test_update_revalidates_instead_of_downloading_again(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  json=bug_return, status=200, content_type='application/json',
+                  match_querystring=True, headers={'ETag': '"abc"'})
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  body='', status=304, match_querystring=True)
+    bug = Bug(Bugsy(cache=MemoryCache(ttl=60)), id=1017315)
+    bug.update()
+    bug.update()
+    assert len(responses.calls) == 2
+    assert responses.calls[1].request.headers['If-None-Match'] == '"abc"'
+    assert bug.summary == 'Schedule Mn tests on opt Linux builds on cedar'
+
+
+@responses.activate
+def test_writes_make_cached_responses_about_the_bug_stale():
+    old = {"bugs": [{"id": 1017315, "summary": "old"}]}
+    new = {"bugs": [{"id": 1017315, "summary": "new"}]}
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', 1017315), json=old,
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', 1017315), json=new,
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', id='1017315'), json=old,
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  json={"bugs": []}, status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  json=new, status=200, content_type='application/json',
+                  match_querystring=True)
+    bugzilla = Bugsy("foo", "bar", cache=MemoryCache(ttl=60))
+    bug = bugzilla.get(1017315)
+    searched = bugzilla.search_for.bug_number([1017315]).search()
+    assert bug.summary == searched[0].summary == 'old'
+
+    bug.summary = 'new'
+    updated = bugzilla.put(bug)
+    assert updated.summary == 'new'
+    assert bugzilla.get(1017315).summary == 'new'
+    calls = len(responses.calls)
+
+    # A search by id that was cached before the write is asked again
+    responses.replace(responses.GET, rest_url('bug', id='1017315'), json=new,
+                      status=200, content_type='application/json',
+                      match_querystring=True)
+    assert bugzilla.search_for.bug_number([1017315]).search()[0].summary == 'new'
+    assert len(responses.calls) == calls + 1
+
+    # update() always asks the server
+    updated.update()
+    assert updated.summary == 'new'
+    assert len(responses.calls) == calls + 2
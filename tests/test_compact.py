@@ -0,0 +1,79 @@
+import datetime
+import json
+import pickle
+
+import pytest
+import responses
+
+from bugsy import (Bugsy, Bug, Comment, CompactAttachment, CompactBug,
+                   CompactComment)
+from bugsy.errors import BugException
+from . import rest_url
+
+
+def test_compact_bug_fields_are_read_like_a_bug(bug_return):
+    data = bug_return['bugs'][0]
+    bug = CompactBug(**data)
+    assert bug.id == 1017315
+    assert bug.summary == 'Schedule Mn tests on opt Linux builds on cedar'
+    assert bug.cc == (u'coop@mozilla.com', u'dburns@mozilla.com',
+                      u'jlund@mozilla.com', u'mdas@mozilla.com')
+    assert bug.cf_user_story == ''
+    assert bug.foo is None
+    assert not hasattr(bug, '__dict__')
+
+
+def test_compact_bug_is_read_only(bug_return):
+    bug = CompactBug(**bug_return['bugs'][0])
+    with pytest.raises(BugException):
+        bug.summary = 'foo'
+
+
+def test_compact_bug_can_become_a_bug(bug_return):
+    compact = CompactBug(**bug_return['bugs'][0])
+    bug = compact.to_bug()
+    assert isinstance(bug, Bug)
+    assert bug.keywords == ['regression']
+    assert bug.diff() == {}
+    assert pickle.loads(pickle.dumps(compact)).id == 1017315
+
+
+def test_compact_comments_and_attachments(comments_return, attachment_return):
+    source = comments_return['bugs']['1017315']['comments'][0]
+    comment = CompactComment(**source)
+    assert comment.text == 'text 1'
+    assert comment.tags == frozenset([u'tag1', u'tag2'])
+    assert comment.creation_time == datetime.datetime(2014, 3, 27, 23, 47, 45)
+    assert isinstance(comment.to_comment(), Comment)
+
+    attachment = CompactAttachment(**attachment_return['bugs']['1017315'][0])
+    assert attachment.file_name == 'file1.txt'
+    assert attachment.last_change_time == datetime.datetime(2019, 9, 18, 18, 31, 57)
+
+
+@responses.activate
+def test_we_can_search_for_compact_bugs():
+    responses.add(responses.GET, rest_url('bug', keywords='checkin-needed'),
+                  body=json.dumps({"bugs": [{"id": 1, "summary": "foo"}]}),
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+    bugzilla = Bugsy()
+    bugs = bugzilla.search_for.keywords('checkin-needed').compact().search()
+    assert isinstance(bugs[0], CompactBug)
+    assert bugs[0].summary == 'foo'
+
+
+def test_compact_bug_knows_which_fields_were_fetched():
+    bug = CompactBug(id=1, summary='Fetched', assigned_to=None, cf_rank=None)
+    assert bug.was_fetched('assigned_to')
+    assert bug.was_fetched('cf_rank')
+    assert not bug.was_fetched('product')
+    assert not bug.was_fetched('cf_other')
+
+
+def test_missing_list_fields_read_as_empty_like_bug():
+    bug = CompactBug(id=1)
+    for field in ('keywords', 'cc', 'blocks', 'depends_on', 'flags'):
+        assert getattr(bug, field) == ()
+        assert list(getattr(bug, field)) == getattr(Bug(id=1), field)
+    assert bug.summary is None
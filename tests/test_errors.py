@@ -1,9 +1,10 @@
 import json
 
 import pytest
+import requests
 import responses
 
-from bugsy import (Bugsy)
+from bugsy import (Bugsy, RetryPolicy)
 from bugsy.errors import (BugsyException)
 from . import rest_url
 
@@ -83,3 +84,119 @@ def test_bugsyexception_raised_for_http_500_when_adding_tags_to_bug_comments(
     with pytest.raises(BugsyException) as e:
         comments[0].add_tags("foo")
     assert str(e.value) == "Message: We received a 500 error with the following: Internal Server Error Code: None"
+
+
+@responses.activate
+def test_we_retry_server_errors_when_given_a_retry_policy(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body='Service Unavailable', status=503,
+                  content_type='text/html', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    policy = RetryPolicy(backoff_factor=0)
+    bugzilla = Bugsy(retry=policy)
+    bug = bugzilla.get(1017315)
+    assert bug.id == 1017315
+    assert len(responses.calls) == 2
+    assert policy.counters == {'requests': 1, 'retries': 1, 'exhausted': 0,
+                               'reasons': {503: 1}}
+
+
+@responses.activate
+def test_we_give_up_after_running_out_of_retries():
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body="It's all broken", status=500,
+                  content_type='application/json', match_querystring=True)
+    policy = RetryPolicy(max_retries=2, backoff_factor=0)
+    bugzilla = Bugsy(retry=policy)
+    with pytest.raises(BugsyException) as e:
+        bugzilla.get(1017315)
+    assert str(e.value) == "Message: We received a 500 error with the following: It's all broken Code: None"
+    assert len(responses.calls) == 3
+    assert policy.counters['exhausted'] == 1
+
+
+@responses.activate
+def test_we_retry_connection_errors():
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=requests.exceptions.ConnectionError('reset'))
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body='{"bugs": [{"id": 1017315}]}', status=200,
+                  content_type='application/json', match_querystring=True)
+    policy = RetryPolicy(backoff_factor=0)
+    bugzilla = Bugsy(retry=policy)
+    assert bugzilla.get(1017315).id == 1017315
+    assert policy.counters['reasons'] == {'connection': 1}
+
+
+@responses.activate
+def test_we_retry_reads_that_time_out():
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=requests.exceptions.ReadTimeout('slow'))
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body='{"bugs": [{"id": 1017315}]}', status=200,
+                  content_type='application/json', match_querystring=True)
+    policy = RetryPolicy()
+    bugzilla = Bugsy(retry=policy)
+    assert bugzilla.get(1017315).id == 1017315
+    assert policy.counters['reasons'] == {'timeout': 1}
+
+
+@responses.activate
+def test_we_dont_repeat_posts_that_time_out():
+    responses.add(responses.POST, 'https://bugzilla.mozilla.org/rest/bug',
+                  body=requests.exceptions.ReadTimeout('slow'))
+    bugzilla = Bugsy(api_key='key')
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        bugzilla.request('bug', 'POST', json={})
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_we_only_retry_posts_when_asked_to():
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.POST, 'https://bugzilla.mozilla.org/rest/bug',
+                  body='Bad Gateway', status=502, content_type='text/html')
+    bugzilla = Bugsy("foo", "bar", retry=RetryPolicy(backoff_factor=0))
+    with pytest.raises(BugsyException):
+        bugzilla.request('bug', 'POST', json={})
+    assert len(responses.calls) == 2
+
+
+def test_backoff_respects_retry_after():
+    policy = RetryPolicy(backoff_factor=1, jitter=False)
+    response = requests.Response()
+    assert policy.backoff(3, response) == 8
+    response.headers['Retry-After'] = '120'
+    assert policy.backoff(3, response) == 120
+    assert policy.backoff(10) == 60
+
+
+@responses.activate
+def test_idempotent_requests_are_retried_by_default(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body='Service Unavailable', status=503,
+                  content_type='text/html', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    bugzilla.retry.backoff_factor = 0
+    assert bugzilla.get(1017315).id == 1017315
+    assert len(responses.calls) == 2
+    assert not bugzilla.retry.retry_non_idempotent
+
+
+@responses.activate
+def test_retrying_can_be_turned_off():
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body='Service Unavailable', status=503,
+                  content_type='text/html', match_querystring=True)
+    bugzilla = Bugsy(retry=False)
+    assert bugzilla.retry is None
+    with pytest.raises(BugsyException):
+        bugzilla.get(1017315)
+    assert len(responses.calls) == 1
@@ -0,0 +1,98 @@
+import copy
+import json
+
+import responses
+
+from bugsy import Bugsy, IdentityMap
+from . import rest_url
+
+FIELDS = Bugsy.DEFAULT_SEARCH + ['last_change_time']
+
+
+@responses.activate
+def test_we_get_the_same_bug_object_back(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315, include_fields=FIELDS),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy(identity_map=True)
+    bug = bugzilla.get(1017315)
+    assert bugzilla.get(1017315) is bug
+    assert 1017315 in bugzilla.identity_map
+
+
+@responses.activate
+def test_searches_share_bugs_with_get(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315, include_fields=FIELDS),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+    fields = Bugsy.DEFAULT_SEARCH + ['flags', 'last_change_time']
+    responses.add(responses.GET, rest_url('bug', id='1017315', include_fields=fields),
+                  body=json.dumps({"bugs": [{"id": 1017315, "flags": [{"name": "needinfo"}]}]}),
+                  status=200, content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy(identity_map=True)
+    bug = bugzilla.get(1017315)
+    bugs = bugzilla.search_for.bug_number([1017315]).include_fields('flags').search()
+    assert bugs[0] is bug
+    assert bug.flags == [{"name": "needinfo"}]
+    assert bug.summary == 'Schedule Mn tests on opt Linux builds on cedar'
+    assert bug.diff() == {}
+
+
+def test_local_changes_are_kept_when_merging(bug_return):
+    bugzilla = Bugsy(identity_map=True)
+    data = bug_return['bugs'][0]
+    bug = bugzilla.identity_map.bug_for(bugzilla, data)
+    bug.summary = 'I changed this'
+    assert bugzilla.identity_map.bug_for(bugzilla, data) is bug
+    assert bug.diff() == {'summary': 'I changed this'}
+
+
+def test_bug_is_rebuilt_when_it_changed_on_the_server(bug_return):
+    bugzilla = Bugsy(identity_map=True)
+    data = copy.deepcopy(bug_return['bugs'][0])
+    bug = bugzilla.identity_map.bug_for(bugzilla, data)
+    bug.summary = 'I changed this'
+    data['last_change_time'] = '2014-06-01T00:00:00Z'
+    data['summary'] = 'Changed on the server'
+    assert bugzilla.identity_map.bug_for(bugzilla, data) is bug
+    assert bug.summary == 'Changed on the server'
+    assert bug.diff() == {}
+
+
+@responses.activate
+def test_put_leaves_nothing_to_send_again(bug_return):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/login',
+                  body='{"token": "foobar"}', status=200,
+                  content_type='application/json', match_querystring=True)
+    data = copy.deepcopy(bug_return)
+    responses.add(responses.GET, rest_url('bug', 1017315, include_fields=FIELDS),
+                  body=json.dumps(data), status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.PUT, 'https://bugzilla.mozilla.org/rest/bug/1017315',
+                  body=json.dumps({'bugs': [{'id': 1017315, 'changes': {},
+                                             'last_change_time': '2014-06-01T00:00:00Z'}]}),
+                  status=200, content_type='application/json')
+    changed = copy.deepcopy(bug_return)
+    changed['bugs'][0]['last_change_time'] = '2014-06-01T00:00:00Z'
+    changed['bugs'][0]['whiteboard'] = 'Set by a bot'
+    responses.add(responses.GET, rest_url('bug', 1017315, include_fields=FIELDS),
+                  body=json.dumps(changed), status=200,
+                  content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy("foo", "bar", identity_map=True)
+    bug = bugzilla.get(1017315)
+    bug.comment = {'body': 'hello'}
+
+    assert bugzilla.put(bug) is bug
+    bug.status = 'ASSIGNED'
+    assert bug.diff() == {'status': 'ASSIGNED'}
+    assert bug.whiteboard == 'Set by a bot'
+
+
+def test_least_recently_used_bugs_are_forgotten():
+    identity_map = IdentityMap(maxsize=2)
+    bugzilla = Bugsy(identity_map=identity_map)
+    for bug_id in [1, 2, 1, 3]:
+        identity_map.bug_for(bugzilla, {'id': bug_id})
+    assert len(identity_map) == 2
+    assert 2 not in identity_map
+    assert identity_map.get(1).id == 1
@@ -0,0 +1,183 @@
+import json
+
+import responses
+from six.moves.urllib import parse
+
+from bugsy import Bugsy, Mirror
+from bugsy.errors import BugsyException
+
+
+def _bug(bug_id, changed, **fields):
+    data = {'id': bug_id, 'product': 'Firefox', 'component': 'General',
+            'status': 'NEW', 'summary': 'Bug %s' % bug_id, 'keywords': [],
+            'assigned_to': 'nobody@mozilla.org', 'whiteboard': '',
+            'creation_time': '2016-01-01T00:00:00Z',
+            'last_change_time': changed}
+    data.update(fields)
+    return data
+
+
+def _comment(comment_id, bug_id, time):
+    return {'id': comment_id, 'bug_id': bug_id, 'count': 0,
+            'text': 'Comment %s' % comment_id, 'author': 'a@example.com',
+            'creator': 'a@example.com', 'time': time, 'creation_time': time,
+            'attachment_id': None, 'is_private': False, 'tags': ['spam']}
+
+
+def _query(call):
+    return parse.parse_qs(parse.urlsplit(call.request.url).query)
+
+
+def _first_sync(bugzilla):
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug',
+                  json={'bugs': [
+                      _bug(1, '2016-01-01T00:00:00Z', keywords=['regression'],
+                           summary='Crash on startup'),
+                      _bug(2, '2016-01-02T00:00:00Z', component='Networking',
+                           whiteboard='[necko-triaged]'),
+                  ]}, status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/comment',
+                  json={'bugs': {
+                      '1': {'comments': [_comment(10, 1, '2016-01-01T00:00:00Z')]},
+                      '2': {'comments': [_comment(20, 2, '2016-01-02T00:00:00Z')]},
+                  }}, status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/attachment',
+                  json={'bugs': {'1': [{'id': 100, 'bug_id': 1,
+                                        'file_name': 'crash.txt',
+                                        'summary': 'Crash log',
+                                        'content_type': 'text/plain',
+                                        'creation_time': '2016-01-01T00:00:00Z',
+                                        'last_change_time': '2016-01-01T00:00:00Z'}]},
+                        'attachments': {}},
+                  status=200, content_type='application/json')
+    mirror = Mirror(bugzilla)
+    bugs = mirror.sync(bugzilla.search_for.product('Firefox'))
+    return mirror, bugs
+
+
+@responses.activate
+def test_we_can_mirror_bugs_comments_and_attachments():
+    bugzilla = Bugsy()
+    mirror, bugs = _first_sync(bugzilla)
+
+    assert [bug.id for bug in bugs] == [1, 2]
+    query = _query(responses.calls[0])
+    assert query['include_fields'] == ['id', '_default', 'last_change_time']
+    assert _query(responses.calls[2])['exclude_fields'] == ['data']
+
+    assert mirror.get(1).summary == 'Crash on startup'
+    assert mirror.get(3) is None
+    assert [c.text for c in mirror.get_comments(2)] == ['Comment 20']
+    assert mirror.get_comments(1)[0].tags == set(['spam'])
+    attachments = mirror.get_attachments(1)
+    assert [a.file_name for a in attachments] == ['crash.txt']
+    assert mirror.get_attachments(2) == []
+
+
+@responses.activate
+def test_we_can_search_the_mirror():
+    bugzilla = Bugsy()
+    mirror, _ = _first_sync(bugzilla)
+    calls = len(responses.calls)
+
+    search = mirror.search_for
+    assert [bug.id for bug in search.product('Firefox').search()] == [1, 2]
+    assert mirror.search_for.keywords('regression').ids() == [1]
+    assert mirror.search_for.summary('startup CRASH').ids() == [1]
+    assert mirror.search_for.summary('startup boom').ids() == []
+    assert mirror.search_for.whiteboard('necko-triaged').ids() == [2]
+    assert mirror.search_for.component('General', 'Networking').count() == 2
+    assert mirror.search_for.assigned_to('nobody@mozilla.org')\
+        .component('Networking').ids() == [2]
+    assert mirror.search_for.timeframe('2016-01-02', None).ids() == [2]
+    assert mirror.search_for.timeframe(None, '2016-01-01').ids() == [1]
+    assert mirror.search_for.summary('100%').ids() == []
+    assert len(responses.calls) == calls
+
+
+@responses.activate
+def test_later_syncs_only_get_changes(tmp_path):
+    path = str(tmp_path / 'bugs.sqlite')
+    bugzilla = Bugsy()
+    mirror = Mirror(bugzilla, path)
+
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug',
+                  json={'bugs': [_bug(1, '2016-01-01T00:00:00Z')]},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug',
+                  json={'bugs': [_bug(1, '2016-01-03T00:00:00Z', status='RESOLVED'),
+                                 _bug(2, '2016-01-03T00:00:00Z')]},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/comment',
+                  json={'bugs': {'1': {'comments': [
+                      _comment(10, 1, '2016-01-01T00:00:00Z')]}}},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/2/comment',
+                  json={'bugs': {'2': {'comments': [
+                      _comment(20, 2, '2016-01-03T00:00:00Z')]}}},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/comment',
+                  json={'bugs': {'1': {'comments': [
+                      _comment(11, 1, '2016-01-03T00:00:00Z')]}}},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/attachment',
+                  json={'bugs': {}, 'attachments': {}},
+                  status=200, content_type='application/json')
+
+    mirror.sync(bugzilla.search_for.product('Firefox'))
+    bugs = mirror.sync(bugzilla.search_for.product('Firefox'))
+
+    assert [bug.id for bug in bugs] == [1, 2]
+    search_query = _query(responses.calls[3])
+    assert search_query['last_change_time'] == ['2016-01-01T00:00:00Z']
+    new_since = [_query(call).get('new_since') for call in responses.calls
+                 if '/comment' in call.request.url]
+    assert new_since == [None, ['2015-12-31T23:59:59Z'], None]
+    mirror.close()
+
+    # The mirror can be searched without Bugzilla
+    offline = Mirror(path=path)
+    assert offline.search_for.product('Firefox').ids() == [1, 2]
+    assert offline.get(1).status == 'RESOLVED'
+    assert [c.id for c in offline.get_comments(1)] == [10, 11]
+    try:
+        offline.sync(bugzilla.search_for.product('Firefox'))
+        assert False, "Should have raised a BugsyException without Bugsy"
+    except BugsyException as e:
+        assert str(e) == "Message: A Mirror needs a Bugsy instance to sync Code: None"
+
+
+@responses.activate
+def test_comments_already_stored_by_another_sync_are_not_fetched_again():
+    bugzilla = Bugsy()
+    mirror = Mirror(bugzilla)
+
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug',
+                  json={'bugs': [_bug(1, '2016-01-01T00:00:00Z')]},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug',
+                  json={'bugs': [_bug(1, '2016-01-03T00:00:00Z')]},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/comment',
+                  json={'bugs': {'1': {'comments': [
+                      _comment(10, 1, '2016-01-01T00:00:00Z')]}}},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/comment',
+                  json={'bugs': {'1': {'comments': [
+                      # Asking from a second early brings back comment 10
+                      # along with one made later in its second
+                      _comment(10, 1, '2016-01-01T00:00:00Z'),
+                      _comment(11, 1, '2016-01-01T00:00:00Z'),
+                      _comment(12, 1, '2016-01-03T00:00:00Z')]}}},
+                  status=200, content_type='application/json')
+    responses.add(responses.GET, 'https://bugzilla.mozilla.org/rest/bug/1/attachment',
+                  json={'bugs': {}, 'attachments': {}},
+                  status=200, content_type='application/json')
+
+    mirror.sync(bugzilla.search_for.product('Firefox'), name='firefox')
+    mirror.sync(bugzilla.search_for.component('General'), name='general')
+
+    new_since = [_query(call).get('new_since') for call in responses.calls
+                 if '/comment' in call.request.url]
+    assert new_since == [None, ['2015-12-31T23:59:59Z']]
+    assert [c.id for c in mirror.get_comments(1)] == [10, 11, 12]
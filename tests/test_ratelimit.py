@@ -0,0 +1,79 @@
+import json
+
+import pytest
+import responses
+
+from bugsy import Bugsy, FileTokenBucket, TokenBucket
+from bugsy.errors import BugsyException
+from . import rest_url
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('bugsy.ratelimit.time', clock)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert clock.slept == [0.5]
+
+
+def test_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=1)
+    bucket.acquire()
+    clock.now += 1
+    bucket.acquire()
+    assert clock.slept == []
+
+
+def test_bucket_needs_a_positive_rate():
+    with pytest.raises(BugsyException):
+        TokenBucket(rate=0)
+
+
+def test_file_bucket_is_shared_between_instances(clock, tmpdir):
+    path = str(tmpdir.join('bucket'))
+    first = FileTokenBucket(path, rate=1, burst=2)
+    second = FileTokenBucket(path, rate=1, burst=2)
+    first.acquire()
+    second.acquire()
+    assert clock.slept == []
+    first.acquire()
+    assert clock.slept == [1.0]
+
+
+@responses.activate
+def test_requests_take_a_token(bug_return):
+    responses.add(responses.GET, rest_url('bug', 1017315),
+                  body=json.dumps(bug_return), status=200,
+                  content_type='application/json', match_querystring=True)
+
+    class CountingBucket(TokenBucket):
+        taken = 0
+
+        def acquire(self, tokens=1):
+            CountingBucket.taken += tokens
+
+    bugzilla = Bugsy(rate_limiter=CountingBucket(rate=10))
+    bugzilla.get(1017315)
+    bugzilla.get(1017315)
+    assert CountingBucket.taken == 2
@@ -1,8 +1,10 @@
+import datetime
 import json
 
 import responses
+from six.moves.urllib import parse
 
-from bugsy import (Bugsy)
+from bugsy import (Bugsy, SearchCursor)
 from bugsy.errors import SearchException
 from . import rest_url
 
@@ -405,39 +407,75 @@ def test_we_can_search_whiteboard_fields():
 def test_we_can_search_for_a_list_of_bug_numbers():
     return_1 = {
      "bugs" : [
+        {
+           "component" : "Marionette",
+           "id" : 1017316,
+           "product" : "Testing",
+           "summary" : "Marionette thinks that the play button in the music app is not displayed"
+        },
         {
            "component" : "CSS Parsing and Computation",
+           "id" : 1017315,
            "product" : "Core",
            "summary" : "Map \"rebeccapurple\" to #663399 in named color list."
         }
       ]
     }
 
-    return_2 = {
-     "bugs" : [
-        {
-           "component" : "Marionette",
-           "product" : "Testing",
-           "summary" : "Marionette thinks that the play button in the music app is not displayed"
-        }
-      ]
-    }
-    responses.add(responses.GET, rest_url('bug', 1017315),
+    responses.add(responses.GET, rest_url('bug', id='1017315,1017316'),
                       body=json.dumps(return_1), status=200,
                       content_type='application/json', match_querystring=True)
+    bugzilla = Bugsy()
+    search = bugzilla.search_for.bug_number(['1017315', '1017316'])
+    bugs = search.search()
+
+    assert len(responses.calls) == 1
+    assert len(bugs) == 2
+    assert bugs[0].id == 1017315
+    assert bugs[0].product == return_1['bugs'][1]['product']
+    assert bugs[0].summary == return_1['bugs'][1]['summary']
+    assert bugs[1].id == 1017316
+    assert search.faults == []
+
+@responses.activate
+def test_we_search_for_bug_numbers_in_chunks():
+    for ids in ['1,2', '3,4', '5']:
+        return_1 = {"bugs": [{"id": int(bug)} for bug in ids.split(',')]}
+        responses.add(responses.GET, rest_url('bug', id=ids),
+                          body=json.dumps(return_1), status=200,
+                          content_type='application/json', match_querystring=True)
 
-    responses.add(responses.GET, rest_url('bug', 1017316),
-                      body=json.dumps(return_2), status=200,
-                      content_type='application/json', match_querystring=True)
     bugzilla = Bugsy()
     bugs = bugzilla.search_for\
-            .bug_number(['1017315', '1017316'])\
+            .bug_number([1, 2, 3, 4, 5], chunk_size=2)\
             .search()
 
-    assert len(responses.calls) == 2
-    assert len(bugs) == 2
-    assert bugs[0].product == return_1['bugs'][0]['product']
-    assert bugs[0].summary == return_1['bugs'][0]['summary']
+    assert len(responses.calls) == 3
+    assert [bug.id for bug in bugs] == [1, 2, 3, 4, 5]
+
+@responses.activate
+def test_missing_bug_numbers_are_reported_as_faults():
+    error_response = {
+        "code" : 102,
+        "documentation" : "http://www.bugzilla.org/docs/tip/en/html/api/",
+        "error" : True,
+        "message" : "You are not authorized to access bug #3."
+    }
+    responses.add(responses.GET, rest_url('bug', id='1,2'),
+                      body=json.dumps({"bugs": [{"id": 2}]}), status=200,
+                      content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', id='3'),
+                      body=json.dumps(error_response), status=401,
+                      content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy()
+    search = bugzilla.search_for.bug_number([1, 2, 3], chunk_size=2)
+    bugs = search.search()
+
+    assert [bug.id for bug in bugs] == [2]
+    assert [fault['id'] for fault in search.faults] == [1, 3]
+    assert search.faults[1]['message'] == "You are not authorized to access bug #3."
+    assert search.faults[1]['code'] == 102
 
 @responses.activate
 def test_we_can_search_for_a_list_of_bug_numbers_with_start_finish_dates():
@@ -556,3 +594,251 @@ def test_we_can_handle_errors_coming_back_from_search():
                 .search()
     except SearchException as e:
         assert str(e) == "Message: Can't use [Bug Creation] as a field name. Code: 108"
+
+@responses.activate
+def test_we_can_iterate_over_search_results_a_page_at_a_time():
+    pages = [[1, 2], [3, 4], [5]]
+    for offset, page in zip([0, 2, 4], pages):
+        url_params = dict(
+            product='Firefox',
+            order='bug_id',
+            limit=2,
+            offset=offset,
+        )
+        responses.add(responses.GET, rest_url('bug', **url_params),
+                      body=json.dumps({"bugs": [{"id": bug} for bug in page]}),
+                      status=200, content_type='application/json',
+                      match_querystring=True)
+
+    bugzilla = Bugsy()
+    bugs = bugzilla.search_for\
+            .product('Firefox')\
+            .iter_search(page_size=2)
+
+    assert next(bugs).id == 1
+    assert len(responses.calls) == 1
+    assert [bug.id for bug in bugs] == [2, 3, 4, 5]
+    assert len(responses.calls) == 3
+
+@responses.activate
+def test_iterating_over_bug_numbers_uses_the_page_size():
+    for ids in ['1,2', '3']:
+        return_1 = {"bugs": [{"id": int(bug)} for bug in ids.split(',')]}
+        responses.add(responses.GET, rest_url('bug', id=ids),
+                          body=json.dumps(return_1), status=200,
+                          content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy()
+    bugs = bugzilla.search_for\
+            .bug_number([1, 2, 3])\
+            .iter_search(page_size=2)
+
+    assert [bug.id for bug in bugs] == [1, 2, 3]
+    assert len(responses.calls) == 2
+
+@responses.activate
+def test_we_can_search_for_bugs_changed_since():
+    responses.add(responses.GET, rest_url('bug', product='Firefox',
+                                          last_change_time='2016-01-02T03:04:05Z'),
+                  json={'bugs': [{'id': 1, 'summary': 'Changed'}]}, status=200,
+                  content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy()
+    bugs = bugzilla.search_for.product('Firefox')\
+        .changed_since(datetime.datetime(2016, 1, 2, 3, 4, 5))\
+        .search()
+
+    assert [bug.id for bug in bugs] == [1]
+
+@responses.activate
+def test_search_cursor_only_returns_new_changes():
+    fields = Bugsy.DEFAULT_SEARCH + ['last_change_time']
+    paging = {'order': 'changeddate,bug_id', 'limit': 1000, 'offset': 0}
+    responses.add(responses.GET, rest_url('bug', product='Firefox',
+                                          include_fields=fields, **paging),
+                  json={'bugs': [
+                      {'id': 1, 'last_change_time': '2016-01-01T00:00:00Z'},
+                      {'id': 2, 'last_change_time': '2016-01-02T00:00:00Z'},
+                      {'id': 3, 'last_change_time': '2016-01-02T00:00:00Z'},
+                  ]}, status=200,
+                  content_type='application/json', match_querystring=True)
+    responses.add(responses.GET, rest_url('bug', product='Firefox',
+                                          include_fields=fields,
+                                          last_change_time='2016-01-02T00:00:00Z',
+                                          **paging),
+                  json={'bugs': [
+                      {'id': 2, 'last_change_time': '2016-01-02T00:00:00Z'},
+                      {'id': 3, 'last_change_time': '2016-01-02T00:00:00Z'},
+                      {'id': 4, 'last_change_time': '2016-01-02T00:00:00Z'},
+                      {'id': 1, 'last_change_time': '2016-01-03T00:00:00Z'},
+                  ]}, status=200,
+                  content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy()
+    cursor = SearchCursor()
+    bugs = cursor.search(bugzilla.search_for.product('Firefox'))
+    assert [bug.id for bug in bugs] == [1, 2, 3]
+    assert cursor.last_change_time == '2016-01-02T00:00:00Z'
+    assert cursor.seen_ids == set([2, 3])
+
+    cursor = SearchCursor.from_json(cursor.to_json())
+    bugs = cursor.search(bugzilla.search_for.product('Firefox'))
+    assert [bug.id for bug in bugs] == [4, 1]
+    assert cursor.last_change_time == '2016-01-03T00:00:00Z'
+    assert cursor.seen_ids == set([1])
+
+@responses.activate
+def test_search_cursor_reads_every_page_before_moving():
+    fields = Bugsy.DEFAULT_SEARCH + ['last_change_time']
+    pages = [
+        # Bug 1 changes after the first page is read, moving it to the end
+        # and bug 3 back onto the first page
+        [(1, '2016-01-01T00:00:00Z'), (2, '2016-01-02T00:00:00Z')],
+        [(4, '2016-01-04T00:00:00Z'), (1, '2016-01-05T00:00:00Z')],
+        # Searching again gets everything in its new order
+        [(2, '2016-01-02T00:00:00Z'), (3, '2016-01-03T00:00:00Z')],
+        [(4, '2016-01-04T00:00:00Z'), (1, '2016-01-05T00:00:00Z')],
+        [],
+    ]
+    for offset, page in zip([0, 2, 0, 2, 4], pages):
+        responses.add(responses.GET,
+                      rest_url('bug', product='Firefox', include_fields=fields,
+                               order='changeddate,bug_id', limit=2,
+                               offset=offset),
+                      json={'bugs': [{'id': bug_id, 'last_change_time': changed}
+                                     for bug_id, changed in page]},
+                      status=200, content_type='application/json',
+                      match_querystring=True)
+
+    search = Bugsy().search_for.product('Firefox')
+    search.PAGE_SIZE = 2
+    cursor = SearchCursor()
+    bugs = cursor.search(search)
+
+    assert [bug.id for bug in bugs] == [2, 3, 4, 1]
+    assert cursor.last_change_time == '2016-01-05T00:00:00Z'
+    assert len(responses.calls) == 5
+
+def _sharded_bugzilla(changes, windows):
+    # Answer searches with the bugs whose change time is in the window
+    def callback(request):
+        query = dict(parse.parse_qsl(parse.urlsplit(request.url).query))
+        start = datetime.datetime.strptime(query['chfieldfrom'], '%Y-%m-%d %H:%M:%S')
+        end = datetime.datetime.strptime(query['chfieldto'], '%Y-%m-%d %H:%M:%S')
+        windows.append((start, end))
+        bugs = [{'id': bug_id, 'product': query['product']}
+                for bug_id, changed in sorted(changes.items())
+                if start <= changed <= end]
+        return (200, {}, json.dumps({'bugs': bugs[:int(query['limit'])]}))
+
+    responses.add_callback(responses.GET, 'https://bugzilla.mozilla.org/rest/bug',
+                           callback=callback, content_type='application/json')
+    return Bugsy()
+
+@responses.activate
+def test_sharded_search_merges_windows():
+    changes = dict((i, datetime.datetime(2014, 1, i)) for i in range(1, 31))
+    windows = []
+    bugzilla = _sharded_bugzilla(changes, windows)
+
+    bugs = bugzilla.search_for.product('Firefox')\
+        .timeframe('2014-01-01', '2014-01-31')\
+        .sharded_search(shards=3)
+
+    assert [bug.id for bug in bugs] == list(range(1, 31))
+    assert sorted(windows) == [
+        (datetime.datetime(2014, 1, 1), datetime.datetime(2014, 1, 11)),
+        (datetime.datetime(2014, 1, 11), datetime.datetime(2014, 1, 21)),
+        (datetime.datetime(2014, 1, 21), datetime.datetime(2014, 1, 31)),
+    ]
+
+@responses.activate
+def test_sharded_search_splits_windows_that_hit_the_limit():
+    changes = dict((i, datetime.datetime(2014, 1, 1, i)) for i in range(1, 9))
+    changes[9] = datetime.datetime(2014, 1, 20)
+    windows = []
+    bugzilla = _sharded_bugzilla(changes, windows)
+
+    bugs = bugzilla.search_for.product('Firefox')\
+        .timeframe(datetime.date(2014, 1, 1), datetime.date(2014, 1, 31))\
+        .sharded_search(shards=2, limit=5)
+
+    assert [bug.id for bug in bugs] == list(range(1, 10))
+    assert len(windows) > 2
+
+def test_sharded_search_needs_a_time_frame():
+    try:
+        Bugsy().search_for.product('Firefox').sharded_search()
+        assert False, "Should have raised a SearchException without a time frame"
+    except SearchException as e:
+        assert "needs the start of a time frame" in str(e)
+
+@responses.activate
+def test_we_can_count_bugs_without_getting_them():
+    responses.add(responses.GET,
+                  'https://bugzilla.mozilla.org/rest/bug?keywords=checkin-needed&count_only=1',
+                  json={'bug_count': 42}, status=200,
+                  content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy()
+    assert bugzilla.search_for.keywords('checkin-needed').count() == 42
+
+@responses.activate
+def test_we_can_get_only_the_ids_of_bugs():
+    responses.add(responses.GET, rest_url('bug', keywords='checkin-needed',
+                                          include_fields='id'),
+                  json={'bugs': [{'id': 3}, {'id': 1}]}, status=200,
+                  content_type='application/json', match_querystring=True)
+
+    bugzilla = Bugsy()
+    assert bugzilla.search_for.keywords('checkin-needed').ids() == [3, 1]
+
+@responses.activate
+def test_ids_and_count_with_bug_numbers():
+    responses.add(responses.GET, rest_url('bug', id='1,2,3', include_fields='id'),
+                  json={'bugs': [{'id': 3}, {'id': 1}],
+                        'faults': [{'id': 2, 'faultString': 'Not allowed',
+                                    'faultCode': 102}]},
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+
+    bugzilla = Bugsy()
+    search = bugzilla.search_for.bug_number([1, 2, 3])
+    assert search.ids() == [1, 3]
+    assert search.faults == [{'id': 2, 'message': 'Not allowed', 'code': 102}]
+    assert search.count() == 2
+
+@responses.activate
+def test_we_can_replace_the_fields_returned():
+    responses.add(responses.GET, rest_url('bug', product='Firefox',
+                                          include_fields=['id', 'summary', 'status']),
+                  json={'bugs': [{'id': 1, 'summary': 'Only', 'status': 'NEW'}]},
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+
+    bugzilla = Bugsy()
+    bugs = bugzilla.search_for.product('Firefox')\
+        .only_fields('summary', 'status')\
+        .search()
+
+    assert bugs[0].summary == 'Only'
+    assert bugs[0].product is None
+    assert not bugs[0].was_fetched('product')
+    assert bugs[0].diff() == {}
+
+@responses.activate
+def test_we_can_exclude_fields_from_field_groups():
+    responses.add(responses.GET, rest_url('bug', product='Firefox',
+                                          include_fields=['id', '_all'],
+                                          exclude_fields=['_custom', 'cc']),
+                  json={'bugs': [{'id': 1, 'summary': 'All of it'}]},
+                  status=200, content_type='application/json',
+                  match_querystring=True)
+
+    bugzilla = Bugsy()
+    bugs = bugzilla.search_for.product('Firefox')\
+        .only_fields('_all')\
+        .exclude_fields('_custom', 'cc', 'id')\
+        .search()
+
+    assert [bug.id for bug in bugs] == [1]